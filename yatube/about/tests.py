@@ -1,8 +1,12 @@
+from django.core.cache import cache
 from django.test import TestCase
 from http import HTTPStatus
 
 
 class PublicURLTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
     def test_public_urls_exists_at_desired_location(self):
         urls = {
             '/about/author/': HTTPStatus.OK,
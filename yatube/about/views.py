@@ -1,9 +1,14 @@
+from django.utils.decorators import method_decorator
 from django.views.generic.base import TemplateView
 
+from core.page_cache import public_page
 
+
+@method_decorator(public_page, name='dispatch')
 class AboutAuthorView(TemplateView):
     template_name = 'about/author.html'
 
 
+@method_decorator(public_page, name='dispatch')
 class AboutTechView(TemplateView):
     template_name = 'about/tech.html'
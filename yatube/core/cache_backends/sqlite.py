@@ -0,0 +1,275 @@
+"""Кеш в файле SQLite, общий для всех процессов на одной машине.
+
+Строки вытесняются по давности последнего чтения (LRU), когда их
+становится больше MAX_ENTRIES. Целые числа хранятся как INTEGER, поэтому
+incr выполняется одним UPDATE без чтения значения в Python.
+"""
+import contextlib
+import os
+import pickle
+import sqlite3
+import threading
+import time
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+# Сколько ключей помещается в один запрос с IN (...).
+KEYS_PER_QUERY = 500
+
+# Время чтения обновляется не чаще раза в столько секунд, чтобы горячие
+# ключи не превращали каждое чтение в запись.
+ACCESS_RESOLUTION = 10
+
+SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS cache ('
+    ' key TEXT PRIMARY KEY,'
+    ' value BLOB NOT NULL,'
+    ' expires REAL,'
+    ' accessed REAL NOT NULL'
+    ') WITHOUT ROWID',
+    'CREATE INDEX IF NOT EXISTS cache_accessed_idx ON cache (accessed)',
+)
+
+ALIVE = '(expires IS NULL OR expires > ?)'
+
+
+def encode(value):
+    # bool — подкласс int, а числа вне int64 SQLite не хранит.
+    if type(value) is int and -2 ** 63 <= value < 2 ** 63:
+        return value
+    return pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+
+
+def decode(value):
+    if isinstance(value, int):
+        return value
+    return pickle.loads(value)
+
+
+def chunks(items, size=KEYS_PER_QUERY):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+class SQLiteCache(BaseCache):
+    """LOCATION — путь к файлу базы; OPTIONS как у LocMemCache.
+
+    Число строк проверяется раз в CULL_EVERY записей процесса, так что
+    между проверками кеш может ненадолго превысить MAX_ENTRIES.
+    """
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        self._path = location
+        self._cull_every = int(
+            params.get('OPTIONS', {}).get('CULL_EVERY', 100)
+        )
+        self._writes = 0
+        self._local = threading.local()
+
+    @property
+    def _db(self):
+        # Соединение своё у каждого потока и у каждого процесса после fork.
+        local = self._local
+        if getattr(local, 'pid', None) != os.getpid():
+            directory = os.path.dirname(self._path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            db = sqlite3.connect(
+                self._path, timeout=30, isolation_level=None
+            )
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            for statement in SCHEMA:
+                db.execute(statement)
+            local.db, local.pid = db, os.getpid()
+        return local.db
+
+    @contextlib.contextmanager
+    def _atomic(self):
+        db = self._db
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            yield db
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+        db.execute('COMMIT')
+
+    def _key(self, key, version):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        return key
+
+    def _written(self, count=1):
+        self._writes += count
+        if self._writes >= self._cull_every:
+            self._writes = 0
+            self._cull()
+
+    def _cull(self):
+        db = self._db
+        db.execute(
+            'DELETE FROM cache WHERE expires <= ?', (time.time(),)
+        )
+        (count,) = db.execute('SELECT COUNT(*) FROM cache').fetchone()
+        if count <= self._max_entries:
+            return
+        if self._cull_frequency == 0:
+            db.execute('DELETE FROM cache')
+            return
+        # Вытесняем давно не читанные строки с запасом, как LocMemCache.
+        excess = count - self._max_entries
+        excess += self._max_entries // self._cull_frequency
+        db.execute(
+            'DELETE FROM cache WHERE key IN ('
+            ' SELECT key FROM cache ORDER BY accessed LIMIT ?)',
+            (excess,),
+        )
+
+    def _touch_accessed(self, keys):
+        now = time.time()
+        with self._atomic():
+            for part in chunks(keys):
+                self._db.execute(
+                    'UPDATE cache SET accessed = ? WHERE key IN ({})'.format(
+                        ', '.join('?' * len(part))
+                    ),
+                    (now, *part),
+                )
+
+    def _select(self, keys):
+        found = {}
+        stale = []
+        now = time.time()
+        for part in chunks(keys):
+            rows = self._db.execute(
+                'SELECT key, value, accessed FROM cache '
+                'WHERE key IN ({}) AND {}'
+                .format(', '.join('?' * len(part)), ALIVE),
+                (*part, now),
+            )
+            for key, value, accessed in rows:
+                found[key] = value
+                if accessed < now - ACCESS_RESOLUTION:
+                    stale.append(key)
+        if stale:
+            self._touch_accessed(stale)
+        return found
+
+    def _upsert(self, rows):
+        now = time.time()
+        self._db.executemany(
+            'INSERT OR REPLACE INTO cache (key, value, expires, accessed) '
+            'VALUES (?, ?, ?, ?)',
+            [(key, encode(value), expires, now)
+             for key, value, expires in rows],
+        )
+        self._written(len(rows))
+
+    def get(self, key, default=None, version=None):
+        key = self._key(key, version)
+        found = self._select([key])
+        return decode(found[key]) if key in found else default
+
+    def get_many(self, keys, version=None):
+        names = {self._key(key, version): key for key in keys}
+        return {
+            names[key]: decode(value)
+            for key, value in self._select(list(names)).items()
+        }
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        expires = self.get_backend_timeout(timeout)
+        with self._atomic():
+            self._upsert([(self._key(key, version), value, expires)])
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        expires = self.get_backend_timeout(timeout)
+        rows = [
+            (self._key(key, version), value, expires)
+            for key, value in data.items()
+        ]
+        with self._atomic():
+            self._upsert(rows)
+        return []
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self._key(key, version)
+        expires = self.get_backend_timeout(timeout)
+        with self._atomic() as db:
+            db.execute(
+                'DELETE FROM cache WHERE key = ? AND NOT {}'.format(ALIVE),
+                (key, time.time()),
+            )
+            added = db.execute(
+                'INSERT OR IGNORE INTO cache (key, value, expires, accessed) '
+                'VALUES (?, ?, ?, ?)',
+                (key, encode(value), expires, time.time()),
+            ).rowcount == 1
+            if added:
+                self._written()
+        return added
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self._key(key, version)
+        with self._atomic() as db:
+            return db.execute(
+                'UPDATE cache SET expires = ? WHERE key = ? AND {}'
+                .format(ALIVE),
+                (self.get_backend_timeout(timeout), key, time.time()),
+            ).rowcount == 1
+
+    def incr(self, key, delta=1, version=None):
+        """Атомарный сдвиг целого значения одним UPDATE.
+
+        Сумма вне int64 SQLite сохранила бы как REAL, поэтому такой
+        UPDATE не выполняется, а incr бросает OverflowError.
+        """
+        key = self._key(key, version)
+        with self._atomic() as db:
+            updated = db.execute(
+                'UPDATE cache SET value = value + ?, accessed = ? '
+                "WHERE key = ? AND typeof(value) = 'integer' "
+                "AND typeof(value + ?) = 'integer' AND {}".format(ALIVE),
+                (delta, time.time(), key, delta, time.time()),
+            ).rowcount
+            row = db.execute(
+                'SELECT value FROM cache WHERE key = ? '
+                "AND typeof(value) = 'integer' AND {}".format(ALIVE),
+                (key, time.time()),
+            ).fetchone()
+        if row is None:
+            raise ValueError("Key '%s' not found" % key)
+        if not updated:
+            raise OverflowError("Key '%s' would overflow int64" % key)
+        return row[0]
+
+    def has_key(self, key, version=None):
+        key = self._key(key, version)
+        return self._db.execute(
+            'SELECT 1 FROM cache WHERE key = ? AND {}'.format(ALIVE),
+            (key, time.time()),
+        ).fetchone() is not None
+
+    def delete(self, key, version=None):
+        self.delete_many([key], version=version)
+
+    def delete_many(self, keys, version=None):
+        keys = [self._key(key, version) for key in keys]
+        with self._atomic() as db:
+            for part in chunks(keys):
+                db.execute(
+                    'DELETE FROM cache WHERE key IN ({})'.format(
+                        ', '.join('?' * len(part))
+                    ),
+                    part,
+                )
+
+    def clear(self):
+        self._db.execute('DELETE FROM cache')
+
+    def close(self, **kwargs):
+        # Соединения живут всё время работы потока: открывать файл на
+        # каждый запрос дороже, чем держать его открытым.
+        pass
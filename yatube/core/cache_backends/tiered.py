@@ -0,0 +1,348 @@
+"""Двухуровневый кеш: память процесса (L1) перед общим кешем (L2).
+
+Настройка::
+
+    CACHES = {
+        'shared': {
+            'BACKEND': 'core.cache_backends.sqlite.SQLiteCache',
+            'LOCATION': '/var/tmp/yatube/cache.sqlite3',
+        },
+        'default': {
+            'BACKEND': 'core.cache_backends.tiered.TieredCache',
+            'LOCATION': '/var/tmp/yatube/cache.bus',
+            'OPTIONS': {'L2': 'shared', 'L1_MAX_ENTRIES': 1000},
+        },
+    }
+
+LOCATION — файл шины инвалидации. Каждая запись в кеш дописывает в него
+изменённые ключи, а соседние воркеры перед чтением из L1 выбрасывают
+их из своей памяти. Шина проверяется не чаще раза в BUS_POLL_INTERVAL
+секунд, так что чужая запись доходит до L1 с такой задержкой. Без
+LOCATION шины нет, и L1 годится только для одного процесса.
+
+Значения в L1 не копируются: изменять полученные из кеша объекты нельзя.
+"""
+import collections
+import contextlib
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: блокировка первого байта файла вместо flock.
+    fcntl = None
+    import msvcrt
+
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+CLEAR = '*'
+TIERS = ('l1_hits', 'l1_misses', 'l2_hits', 'l2_misses')
+
+
+def stats_key(name):
+    return f'tiered_stats:{name}'
+
+
+@contextlib.contextmanager
+def locked(file):
+    """Монопольная блокировка открытого файла между процессами."""
+    if fcntl is not None:
+        fcntl.flock(file, fcntl.LOCK_EX)
+        yield
+        return
+    file.seek(0)
+    msvcrt.locking(file.fileno(), msvcrt.LK_LOCK, 1)
+    try:
+        yield
+    finally:
+        file.seek(0)
+        msvcrt.locking(file.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+class InvalidationBus:
+    """Журнал изменённых ключей в файле, общий для процессов на машине.
+
+    Разросшийся журнал заменяется пустым; увидев новый файл, процесс
+    очищает L1 целиком, так что пропущенные строки ничего не ломают.
+    """
+
+    def __init__(self, path, max_bytes):
+        self.path = path
+        self.max_bytes = max_bytes
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        open(path, 'a').close()
+        stat = os.stat(path)
+        self.inode, self.offset = stat.st_ino, stat.st_size
+
+    def publish(self, keys, origin):
+        lines = ''.join(f'{origin} {key}\n' for key in keys)
+        while True:
+            with open(self.path, 'a', encoding='utf-8') as bus, locked(bus):
+                stat = os.fstat(bus.fileno())
+                # Пока ждали блокировку, журнал могли заменить новым.
+                if stat.st_ino != self._inode_on_disk():
+                    continue
+                if stat.st_size > self.max_bytes:
+                    fresh = f'{self.path}.{os.getpid()}'
+                    open(fresh, 'w').close()
+                    os.replace(fresh, self.path)
+                    return
+                bus.write(lines)
+                return
+
+    def _inode_on_disk(self):
+        try:
+            return os.stat(self.path).st_ino
+        except FileNotFoundError:
+            return None
+
+    def poll(self, origin):
+        """Ключи, изменённые другими процессами; CLEAR — сбросить всё."""
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return [CLEAR]
+        if stat.st_ino != self.inode:
+            self.inode, self.offset = stat.st_ino, stat.st_size
+            return [CLEAR]
+        if stat.st_size <= self.offset:
+            return []
+        with open(self.path, 'rb') as bus:
+            bus.seek(self.offset)
+            data = bus.read(stat.st_size - self.offset)
+        # Недописанная последняя строка дочитается в следующий раз.
+        complete = data.rfind(b'\n') + 1
+        self.offset += complete
+        keys = []
+        for line in data[:complete].decode('utf-8').splitlines():
+            author, _, key = line.partition(' ')
+            if author != origin:
+                keys.append(key)
+        return keys
+
+
+class TieredCache(BaseCache):
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self._l2_alias = options.get('L2', 'shared')
+        self._l1_max_entries = int(options.get('L1_MAX_ENTRIES', 1000))
+        # Страховка на случай потерянной инвалидации.
+        self._l1_timeout = float(options.get('L1_TIMEOUT', 60))
+        self._stats_every = int(options.get('STATS_EVERY', 1000))
+        self._poll_interval = float(options.get('BUS_POLL_INTERVAL', 0.1))
+        self._next_poll = 0
+        # Растёт при каждой инвалидации L1: значение, прочитанное из L2
+        # до неё, в L1 не кладётся.
+        self._generation = 0
+        self._bus = location and InvalidationBus(
+            location, int(options.get('BUS_MAX_BYTES', 1 << 20))
+        )
+        self._l1 = collections.OrderedDict()
+        self._lock = threading.RLock()
+        self._stats = dict.fromkeys(TIERS, 0)
+        self._pid = os.getpid()
+
+    @property
+    def origin(self):
+        # Своё у каждого экземпляра и у каждого процесса после fork.
+        return f'{os.getpid()}.{id(self)}'
+
+    @property
+    def l2(self):
+        return caches[self._l2_alias]
+
+    def _key(self, key, version):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        return key
+
+    def _sync(self, force=False):
+        if os.getpid() != self._pid:
+            # После fork память родителя не должна обслуживать потомка.
+            self._pid = os.getpid()
+            self._l1.clear()
+            self._stats = dict.fromkeys(TIERS, 0)
+            force = True
+        now = time.monotonic()
+        if not self._bus or not force and now < self._next_poll:
+            return
+        self._next_poll = now + self._poll_interval
+        keys = self._bus.poll(self.origin)
+        if not keys:
+            return
+        self._generation += 1
+        if CLEAR in keys:
+            self._l1.clear()
+            return
+        for key in keys:
+            self._l1.pop(key, None)
+
+    def _l1_get(self, key):
+        entry = self._l1.get(key)
+        if entry is None or entry[1] < time.monotonic():
+            self._l1.pop(key, None)
+            return None
+        self._l1.move_to_end(key)
+        return entry
+
+    def _l1_set(self, key, value, timeout=DEFAULT_TIMEOUT):
+        if timeout == DEFAULT_TIMEOUT:
+            timeout = self.default_timeout
+        lifetime = self._l1_timeout
+        if timeout is not None:
+            lifetime = min(lifetime, timeout)
+        if lifetime <= 0:
+            self._l1.pop(key, None)
+            return
+        self._l1[key] = (value, time.monotonic() + lifetime)
+        self._l1.move_to_end(key)
+        while len(self._l1) > self._l1_max_entries:
+            self._l1.popitem(last=False)
+
+    def _count(self, **deltas):
+        for name, delta in deltas.items():
+            self._stats[name] += delta
+        if sum(self._stats.values()) >= self._stats_every:
+            self.flush_stats()
+
+    def _changed(self, keys):
+        with self._lock:
+            self._generation += 1
+            for key in keys:
+                self._l1.pop(key, None)
+        if self._bus:
+            self._bus.publish(keys, self.origin)
+
+    def flush_stats(self):
+        """Переносит счётчики процесса в L2, где их видят все воркеры."""
+        stats, self._stats = self._stats, dict.fromkeys(TIERS, 0)
+        for name, delta in stats.items():
+            if not delta:
+                continue
+            key = stats_key(name)
+            self.l2.add(key, 0, None)
+            try:
+                self.l2.incr(key, delta)
+            except ValueError:
+                self.l2.set(key, delta, None)
+
+    def tier_stats(self):
+        """Доли попаданий по уровням, собранные со всех воркеров."""
+        self.flush_stats()
+        totals = self.l2.get_many([stats_key(name) for name in TIERS])
+        counts = {name: totals.get(stats_key(name), 0) for name in TIERS}
+        for tier in ('l1', 'l2'):
+            hits, misses = counts[f'{tier}_hits'], counts[f'{tier}_misses']
+            counts[f'{tier}_hit_rate'] = hits / (hits + misses or 1)
+        return counts
+
+    def _fill_l1(self, values, generation):
+        """Кладёт прочитанные из L2 значения в L1, если их не сбросили.
+
+        Шина проверяется ещё раз: пока шло чтение из L2, значение могли
+        изменить в этом или другом процессе.
+        """
+        self._sync(force=True)
+        if self._generation != generation:
+            return
+        for name, value in values.items():
+            self._l1_set(name, value)
+
+    def get(self, key, default=None, version=None):
+        name = self._key(key, version)
+        with self._lock:
+            self._sync()
+            entry = self._l1_get(name)
+            if entry is not None:
+                self._count(l1_hits=1)
+                return entry[0]
+            generation = self._generation
+        value = self.l2.get(key, version=version)
+        with self._lock:
+            if value is None:
+                self._count(l1_misses=1, l2_misses=1)
+                return default
+            self._count(l1_misses=1, l2_hits=1)
+            self._fill_l1({name: value}, generation)
+        return value
+
+    def get_many(self, keys, version=None):
+        names = {key: self._key(key, version) for key in keys}
+        found = {}
+        with self._lock:
+            self._sync()
+            for key, name in names.items():
+                entry = self._l1_get(name)
+                if entry is not None:
+                    found[key] = entry[0]
+            generation = self._generation
+        missing = [key for key in keys if key not in found]
+        fetched = self.l2.get_many(missing, version=version) if missing else {}
+        with self._lock:
+            self._count(
+                l1_hits=len(found),
+                l1_misses=len(missing),
+                l2_hits=len(fetched),
+                l2_misses=len(missing) - len(fetched),
+            )
+            self._fill_l1(
+                {names[key]: value for key, value in fetched.items()},
+                generation,
+            )
+        found.update(fetched)
+        return found
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self.l2.set(key, value, timeout, version=version)
+        name = self._key(key, version)
+        self._changed([name])
+        with self._lock:
+            self._l1_set(name, value, timeout)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        failed = self.l2.set_many(data, timeout, version=version)
+        names = {key: self._key(key, version) for key in data}
+        self._changed(list(names.values()))
+        with self._lock:
+            for key, value in data.items():
+                if key not in failed:
+                    self._l1_set(names[key], value, timeout)
+        return failed
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        added = self.l2.add(key, value, timeout, version=version)
+        if added:
+            self._changed([self._key(key, version)])
+        return added
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        self._changed([self._key(key, version)])
+        return self.l2.touch(key, timeout, version=version)
+
+    def incr(self, key, delta=1, version=None):
+        value = self.l2.incr(key, delta, version=version)
+        self._changed([self._key(key, version)])
+        return value
+
+    def has_key(self, key, version=None):
+        return self.get(key, version=version) is not None
+
+    def delete(self, key, version=None):
+        self.l2.delete(key, version=version)
+        self._changed([self._key(key, version)])
+
+    def delete_many(self, keys, version=None):
+        self.l2.delete_many(keys, version=version)
+        self._changed([self._key(key, version) for key in keys])
+
+    def clear(self):
+        self.l2.clear()
+        self._changed([CLEAR])
+        with self._lock:
+            self._l1.clear()
@@ -0,0 +1,76 @@
+import time
+
+from django.core.cache import cache
+from django.db.models.signals import post_delete, post_save
+
+from .stampede import get_or_compute
+
+# Версия тега живёт дольше любой помеченной им записи.
+TAG_VERSION_TTL = 60 * 60 * 24
+TAG_BATCH_SIZE = 1000
+
+
+def tag(name, pk=None):
+    return f'{name}:{pk}' if pk is not None else name
+
+
+def version_key(name):
+    return f'tag_version:{name}'
+
+
+def tag_versions(tags):
+    """Текущие версии тегов; отсутствующие заводятся заново.
+
+    Новая версия берётся из часов, поэтому после сброса тега ключ записи
+    не совпадёт ни с одним из закешированных ранее.
+    """
+    keys = [version_key(name) for name in tags]
+    versions = cache.get_many(keys)
+    missing = {key: time.time_ns() for key in keys if key not in versions}
+    if missing:
+        cache.set_many(missing, TAG_VERSION_TTL)
+        versions.update(missing)
+    return [versions[key] for key in keys]
+
+
+def invalidate_tags(tags):
+    keys = [version_key(name) for name in set(tags)]
+    for start in range(0, len(keys), TAG_BATCH_SIZE):
+        cache.delete_many(keys[start:start + TAG_BATCH_SIZE])
+
+
+def tag_signature(tags):
+    """Подпись версий тегов: сброс любого тега меняет её."""
+    return '|'.join(map(str, tag_versions(tags)))
+
+
+def tagged_key(key, tags):
+    return '|'.join([key, *tags])
+
+
+def cached(key, tags, timeout, compute):
+    """Значение, зависящее от тегов, из кеша или результат compute().
+
+    Пока значение после сброса тега пересчитывает один воркер, остальные
+    отдают прежнее.
+    """
+    return get_or_compute(
+        tagged_key(key, tags), compute, timeout, tag_signature(tags)
+    )
+
+
+def register(model, tags, delete=True):
+    """Сбрасывает теги tags(instance) при сохранении и удалении model.
+
+    delete=False оставляет модель без обработчиков удаления, чтобы Django
+    мог удалять её строки одним запросом.
+    """
+    def invalidate(sender, instance, **kwargs):
+        invalidate_tags(tags(instance))
+
+    uid = f'cache_tags:{model._meta.label}'
+    post_save.connect(invalidate, sender=model, weak=False, dispatch_uid=uid)
+    if delete:
+        post_delete.connect(
+            invalidate, sender=model, weak=False, dispatch_uid=uid
+        )
@@ -0,0 +1,41 @@
+"""Условные GET-запросы по версиям тегов кеша.
+
+Версия тега — время его последнего сброса, поэтому ETag страницы
+получается из кеша, без запросов к постам и без рендера. Last-Modified
+не отдаётся: в HTTP-дате нет долей секунды, и сброс в ту же секунду,
+что и прошлый ответ, получил бы 304.
+"""
+import hashlib
+
+from django.views.decorators.http import condition
+
+from .cache_tags import tag_versions
+
+
+def page_versions(request, page_tags, args, kwargs):
+    # Теги страницы ищутся один раз за запрос.
+    if not hasattr(request, 'conditional_versions'):
+        tags = page_tags(request, *args, **kwargs)
+        request.conditional_versions = (
+            None if tags is None else tag_versions(tags)
+        )
+    return request.conditional_versions
+
+
+def conditional_page(page_tags):
+    """Отвечает 304, пока не сброшен ни один тег страницы.
+
+    page_tags(request, *args, **kwargs) возвращает теги страницы или None,
+    если страницы нет. В ETag входит пользователь: шапка у каждого своя.
+    """
+    def etag(request, *args, **kwargs):
+        versions = page_versions(request, page_tags, args, kwargs)
+        if versions is None:
+            return None
+        user = request.user.pk if request.user.is_authenticated else ''
+        raw = '|'.join(
+            [request.get_full_path(), str(user), *map(str, versions)]
+        )
+        return hashlib.md5(raw.encode()).hexdigest()
+
+    return condition(etag_func=etag)
@@ -0,0 +1,84 @@
+import multiprocessing
+import os
+import tempfile
+import time
+
+from django.core.cache.backends.filebased import FileBasedCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.management.base import BaseCommand
+
+from core.cache_backends.sqlite import SQLiteCache
+
+BATCH = 100
+
+
+def set_in_child(backend):
+    backend.set('shared', 'из другого процесса')
+
+
+def operations(backend, keys):
+    value = {'text': 'x' * 200, 'ids': list(range(20))}
+    batches = [keys[i:i + BATCH] for i in range(0, len(keys), BATCH)]
+    return {
+        'set': lambda: [backend.set(key, value) for key in keys],
+        'get': lambda: [backend.get(key) for key in keys],
+        'set_many': lambda: [
+            backend.set_many(dict.fromkeys(batch, value))
+            for batch in batches
+        ],
+        'get_many': lambda: [backend.get_many(batch) for batch in batches],
+        'incr': lambda: [
+            backend.set('counter', 0),
+            *(backend.incr('counter') for _ in keys),
+        ],
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        'Сравнивает скорость LocMemCache, FileBasedCache и SQLiteCache '
+        'и проверяет, видят ли процессы записи друг друга.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--keys', type=int, default=1000)
+
+    def backends(self, directory):
+        params = {'OPTIONS': {'MAX_ENTRIES': 100_000}}
+        return {
+            'locmem': LocMemCache('benchmark', params),
+            'filebased': FileBasedCache(
+                os.path.join(directory, 'files'), params
+            ),
+            'sqlite': SQLiteCache(
+                os.path.join(directory, 'cache.sqlite3'), params
+            ),
+        }
+
+    def shared(self, backend):
+        # fork копирует LocMemCache, но запись в копии не видна родителю.
+        process = multiprocessing.get_context('fork').Process(
+            target=set_in_child, args=(backend,)
+        )
+        process.start()
+        process.join()
+        return backend.get('shared') is not None
+
+    def handle(self, *args, **options):
+        keys = [f'key:{i}' for i in range(options['keys'])]
+        self.stdout.write(
+            f'{"backend":<10}{"operation":<10}{"ops/s":>12}'
+        )
+        with tempfile.TemporaryDirectory() as directory:
+            for name, backend in self.backends(directory).items():
+                for operation, run in operations(backend, keys).items():
+                    started = time.perf_counter()
+                    run()
+                    elapsed = time.perf_counter() - started
+                    self.stdout.write(
+                        f'{name:<10}{operation:<10}'
+                        f'{len(keys) / elapsed:>12.0f}'
+                    )
+                self.stdout.write(
+                    f'{name:<10}{"shared":<10}{str(self.shared(backend)):>12}'
+                )
@@ -0,0 +1,14 @@
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = 'Показывает попадания в уровни L1 и L2 кеша по всем воркерам.'
+
+    def handle(self, *args, **options):
+        if not hasattr(cache, 'tier_stats'):
+            raise CommandError('Кеш по умолчанию не двухуровневый.')
+        for name, value in cache.tier_stats().items():
+            if name.endswith('_rate'):
+                value = f'{value:.1%}'
+            self.stdout.write(f'{name:<14}{value:>10}')
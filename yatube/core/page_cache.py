@@ -0,0 +1,137 @@
+"""Кеш целых страниц с персональными «дырками».
+
+Страница сохраняется без персональных фрагментов: на их месте в шаблоне
+стоит {% hole %}, который при рендере для кеша оставляет метку. Каждый
+ответ, из кеша или свежий, получает фрагменты, отрисованные для
+текущего пользователя. Страница действительна, пока не сброшен ни один
+из тегов, которые указало представление через page_tags().
+"""
+import functools
+import re
+
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.template.loader import render_to_string
+
+from .cache_tags import tag_versions
+from .stampede import LEASE_TIMEOUT, lease_key
+
+PAGE_CACHE_TTL = 60 * 60 * 6
+HOLE = '<!--hole:{}-->'
+HOLE_RE = re.compile(r'<!--hole:([\w/.-]+)-->')
+# Параметры запроса, от которых зависит страница, и их допустимый вид.
+# Остальные параметры (utm-метки и т. п.) в ключи кеша не попадают.
+PAGE_PARAMS = {
+    'page': re.compile(r'[1-9][0-9]{0,5}'),
+    'cursor': re.compile(r'[A-Za-z0-9_-]{1,128}'),
+}
+
+
+def page_position(request):
+    """Значения PAGE_PARAMS запроса для ключей кеша.
+
+    None — если параметр испорчен: ответ на такой запрос не кешируется,
+    чтобы не лечь под ключ обычной страницы и не засорять кеш.
+    """
+    position = []
+    for name, pattern in PAGE_PARAMS.items():
+        value = request.GET.get(name, '')
+        if value and not pattern.fullmatch(value):
+            return None
+        position.append(value)
+    return position
+
+
+def page_key(request):
+    position = page_position(request)
+    if position is None:
+        return None
+    return f'page:{request.path}|{"|".join(position)}'
+
+
+def page_tags(request, tags):
+    """Теги, от которых зависит страница; возвращает их подпись.
+
+    Подпись берётся до рендера: пост, сохранённый во время рендера,
+    сбросит страницу при следующем запросе.
+    """
+    versions = tag_versions(tags)
+    if punches_holes(request):
+        request.page_tags += tags
+        request.page_versions += versions
+    return '|'.join(map(str, versions))
+
+
+def punches_holes(request):
+    return getattr(request, 'page_tags', None) is not None
+
+
+def fill_holes(body, request):
+    rendered = {}
+
+    def personal(match):
+        name = match.group(1)
+        if name not in rendered:
+            rendered[name] = render_to_string(name, request=request)
+        return rendered[name]
+
+    return HOLE_RE.sub(personal, body)
+
+
+def is_valid(entry):
+    _, _, tags, versions = entry
+    return tag_versions(tags) == versions
+
+
+def render_page(view, request, args, kwargs):
+    request.page_tags, request.page_versions = [], []
+    response = view(request, *args, **kwargs)
+    if hasattr(response, 'render') and callable(response.render):
+        response = response.render()
+    if response.status_code == 200 and not response.cookies:
+        entry = (
+            response.content.decode(response.charset),
+            response['Content-Type'],
+            request.page_tags,
+            request.page_versions,
+        )
+        cache.set(page_key(request), entry, PAGE_CACHE_TTL)
+    response.content = fill_holes(
+        response.content.decode(response.charset), request
+    )
+    return response
+
+
+def public_page(view=None, anonymous_only=False):
+    """Кеширует GET-ответы представления целиком.
+
+    anonymous_only — у страницы есть персональные части кроме дырок,
+    поэтому вошедшим пользователям она отрисовывается заново.
+    """
+    if view is None:
+        return functools.partial(public_page, anonymous_only=anonymous_only)
+
+    @functools.wraps(view)
+    def wrapped(request, *args, **kwargs):
+        key = page_key(request)
+        if key is None or request.method not in ('GET', 'HEAD') or (
+            anonymous_only and request.user.is_authenticated
+        ):
+            return view(request, *args, **kwargs)
+        entry = cache.get(key)
+        if entry is None:
+            return render_page(view, request, args, kwargs)
+        # Устаревшую страницу перерисовывает один воркер, остальные пока
+        # отдают старую.
+        lease = lease_key(key)
+        if is_valid(entry) or not cache.add(lease, 1, LEASE_TIMEOUT):
+            body, content_type, _, _ = entry
+            return HttpResponse(
+                fill_holes(body, request), content_type=content_type
+            )
+        try:
+            return render_page(view, request, args, kwargs)
+        finally:
+            cache.delete(lease)
+
+    return wrapped
@@ -0,0 +1,86 @@
+"""Пересчёт закешированных значений без лавины одновременных запросов.
+
+Значение хранится вместе с версией, сроком свежести и временем, которое
+ушло на его расчёт. Устаревшее значение пересчитывает только воркер,
+взявший аренду ключа, остальные в это время отдают старое. Срок
+свежести для каждого чтения немного сдвигается в прошлое случайным
+образом (XFetch), так что пересчёт чаще начинается до истечения срока и
+не совпадает у всех воркеров.
+"""
+import math
+import random
+import time
+
+from django.core.cache import cache
+
+# Сколько секунд держится аренда пересчёта, если воркер упал.
+LEASE_TIMEOUT = 30
+# Сколько ждать чужого пересчёта, когда старого значения нет вовсе.
+LEASE_WAIT = 2
+LEASE_POLL = 0.05
+# Коэффициент раннего пересчёта: больше — раньше.
+EARLY_BETA = 1.0
+
+
+def lease_key(key):
+    return f'lease:{key}'
+
+
+def is_stale(envelope, version, beta=EARLY_BETA):
+    _, stored_version, fresh_until, delta = envelope
+    if stored_version != version:
+        return True
+    if fresh_until is None:
+        return False
+    early = delta * beta * -math.log(1.0 - random.random())
+    return time.time() + early >= fresh_until
+
+
+def store(key, compute, timeout, version):
+    started = time.monotonic()
+    value = compute()
+    delta = time.monotonic() - started
+    if timeout is None:
+        fresh_until = hard_timeout = None
+    else:
+        fresh_until = time.time() + timeout
+        # Старое значение живёт ещё столько же, чтобы было что отдать,
+        # пока идёт пересчёт.
+        hard_timeout = 2 * timeout
+    cache.set(key, (value, version, fresh_until, delta), hard_timeout)
+    return value
+
+
+def wait_for(key, version):
+    deadline = time.monotonic() + LEASE_WAIT
+    while time.monotonic() < deadline:
+        time.sleep(LEASE_POLL)
+        envelope = cache.get(key)
+        if envelope is not None and envelope[1] == version:
+            return envelope
+    return None
+
+
+def get_or_compute(key, compute, timeout, version=None):
+    """Значение по ключу; пересчитывает его не больше одного воркера.
+
+    version — подпись данных, из которых построено значение (например,
+    версии тегов): значение другой версии считается устаревшим, но
+    отдаётся, пока его пересчитывают.
+    """
+    envelope = cache.get(key)
+    if envelope is not None and not is_stale(envelope, version):
+        return envelope[0]
+    lease = lease_key(key)
+    if not cache.add(lease, 1, LEASE_TIMEOUT):
+        if envelope is not None:
+            return envelope[0]
+        envelope = wait_for(key, version)
+        if envelope is not None:
+            return envelope[0]
+        # Держатель аренды не успел: считаем сами, но без неё.
+        return store(key, compute, timeout, version)
+    try:
+        return store(key, compute, timeout, version)
+    finally:
+        cache.delete(lease)
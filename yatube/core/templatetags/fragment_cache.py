@@ -0,0 +1,57 @@
+from django import template
+from django.core.cache.utils import make_template_fragment_key
+
+from core.stampede import get_or_compute
+
+register = template.Library()
+
+
+class FragmentCacheNode(template.Node):
+    def __init__(self, nodelist, timeout, name, vary_on, version):
+        self.nodelist = nodelist
+        self.timeout = timeout
+        self.name = name
+        self.vary_on = vary_on
+        self.version = version
+
+    def render(self, context):
+        timeout = self.timeout.resolve(context)
+        if timeout is not None and int(timeout) == 0:
+            return self.nodelist.render(context)
+        key = make_template_fragment_key(
+            self.name, [var.resolve(context) for var in self.vary_on]
+        )
+        version = self.version.resolve(context) if self.version else None
+        return get_or_compute(
+            key,
+            lambda: self.nodelist.render(context),
+            None if timeout is None else int(timeout),
+            version,
+        )
+
+
+@register.tag
+def fragment_cache(parser, token):
+    """Как {% cache %}, но пересчитывает фрагмент один воркер.
+
+    {% fragment_cache timeout name var1 var2 version=expr %}
+    Фрагмент другой версии отдаётся, пока его пересчитывают. Со сроком
+    0 фрагмент не кешируется.
+    """
+    nodelist = parser.parse(('endfragment_cache',))
+    parser.delete_first_token()
+    tokens = token.split_contents()
+    version = None
+    if tokens[-1].startswith('version='):
+        version = parser.compile_filter(tokens.pop()[len('version='):])
+    if len(tokens) < 3:
+        raise template.TemplateSyntaxError(
+            f'{tokens[0]} требует срок жизни и имя фрагмента.'
+        )
+    return FragmentCacheNode(
+        nodelist,
+        parser.compile_filter(tokens[1]),
+        tokens[2],
+        [parser.compile_filter(name) for name in tokens[3:]],
+        version,
+    )
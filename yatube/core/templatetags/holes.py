@@ -0,0 +1,19 @@
+from django import template
+from django.utils.safestring import mark_safe
+
+from core.page_cache import HOLE, punches_holes
+
+register = template.Library()
+
+
+@register.simple_tag(takes_context=True)
+def hole(context, template_name):
+    """Персональный фрагмент страницы, которая кешируется целиком.
+
+    В закешированную страницу попадает метка, а сам фрагмент рисуется
+    для каждого запроса отдельно. Вне кеша работает как include.
+    """
+    request = context.get('request')
+    if request is not None and punches_holes(request):
+        return mark_safe(HOLE.format(template_name))
+    return context.template.engine.get_template(template_name).render(context)
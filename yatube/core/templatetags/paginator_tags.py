@@ -0,0 +1,28 @@
+from django import template
+
+
+register = template.Library()
+
+PAGES_ON_EACH_SIDE = 2
+PAGES_ON_ENDS = 1
+
+
+@register.filter
+def elided_page_range(page_obj):
+    """Номера страниц вокруг текущей и по краям; None на месте пропуска."""
+    number = page_obj.number
+    num_pages = page_obj.paginator.num_pages
+    window = range(
+        max(number - PAGES_ON_EACH_SIDE, 1),
+        min(number + PAGES_ON_EACH_SIDE, num_pages) + 1,
+    )
+    head = range(1, min(PAGES_ON_ENDS, num_pages) + 1)
+    tail = range(max(num_pages - PAGES_ON_ENDS + 1, 1), num_pages + 1)
+    pages = []
+    for i in sorted(set(head) | set(window) | set(tail)):
+        if pages and i - pages[-1] == 2:
+            pages.append(i - 1)
+        elif pages and i - pages[-1] > 2:
+            pages.append(None)
+        pages.append(i)
+    return pages
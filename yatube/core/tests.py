@@ -1,9 +1,20 @@
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
 from http import HTTPStatus
+from unittest import mock
 
-from django.test import TestCase, Client
+from django.core.cache import cache, caches
+from django.test import TestCase, Client, override_settings
 from django.urls import reverse
 
-from posts.models import User
+from core.cache_backends.sqlite import SQLiteCache
+from core.cache_backends.tiered import TieredCache
+from core.cache_tags import cached, invalidate_tags
+from core.stampede import get_or_compute, lease_key
+from posts.models import Comment, Follow, Group, Post, User
 
 
 class CoreURLTests(TestCase):
@@ -29,3 +40,291 @@ class CoreURLTests(TestCase):
             follow=True
         )
         self.assertTemplateUsed(response, 'core/403csrf.html')
+
+
+class CacheTagsTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='auth')
+        cls.reader = User.objects.create_user(username='reader')
+        cls.group = Group.objects.create(
+            title='Тестовая группа',
+            slug='test-slug',
+            description='Тестовое описание',
+        )
+        cls.post = Post.objects.create(author=cls.user, text='Пост')
+
+    def setUp(self):
+        cache.clear()
+        self.calls = 0
+
+    def compute(self):
+        self.calls += 1
+        return self.calls
+
+    def test_value_is_cached_until_tag_is_invalidated(self):
+        tags = ['group:1', 'author:2']
+        self.assertEqual(cached('key', tags, 60, self.compute), 1)
+        self.assertEqual(cached('key', tags, 60, self.compute), 1)
+        invalidate_tags(['author:2'])
+        self.assertEqual(cached('key', tags, 60, self.compute), 2)
+        self.assertEqual(cached('key', ['group:1'], 60, self.compute), 3)
+
+    def test_model_signals_invalidate_tags(self):
+        changes = {
+            f'post:{self.post.pk}': lambda: Comment.objects.create(
+                post=self.post, author=self.reader, text='Комментарий'
+            ),
+            f'group:{self.group.pk}': self.group.save,
+            f'follow:{self.reader.pk}': lambda: Follow.objects.create(
+                user=self.reader, author=self.user
+            ),
+            f'author:{self.user.pk}': self.post.delete,
+        }
+        for name, change in changes.items():
+            with self.subTest(tag=name):
+                first = cached(name, [name], 60, self.compute)
+                change()
+                self.assertNotEqual(
+                    cached(name, [name], 60, self.compute), first
+                )
+
+
+class SQLiteCacheTest(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'cache.sqlite3')
+        self.cache = self.backend()
+
+    def backend(self, **options):
+        return SQLiteCache(self.path, {'OPTIONS': options})
+
+    def test_values_are_shared_between_instances(self):
+        self.cache.set('post', {'text': 'Пост'})
+        self.cache.set_many({'a': 1, 'b': [2]})
+        other = self.backend()
+        self.assertEqual(other.get('post'), {'text': 'Пост'})
+        self.assertEqual(
+            other.get_many(['a', 'b', 'c']), {'a': 1, 'b': [2]}
+        )
+        other.delete_many(['a', 'post'])
+        self.assertIsNone(self.cache.get('post'))
+        self.assertEqual(self.cache.get_many(['a', 'b']), {'b': [2]})
+
+    def test_expired_values_are_missing(self):
+        self.cache.set('gone', 1, timeout=-1)
+        self.assertIsNone(self.cache.get('gone'))
+        self.assertTrue(self.cache.add('gone', 2))
+        self.assertFalse(self.cache.add('gone', 3))
+        self.assertEqual(self.cache.get('gone'), 2)
+
+    def test_incr_is_atomic(self):
+        self.cache.set('counter', 0)
+        workers = [
+            threading.Thread(
+                target=lambda: [self.cache.incr('counter') for _ in range(50)]
+            )
+            for _ in range(4)
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        self.assertEqual(self.cache.get('counter'), 200)
+        self.assertEqual(self.cache.decr('counter', 10), 190)
+        with self.assertRaises(ValueError):
+            self.cache.incr('missing')
+
+    def test_incr_does_not_overflow_int64(self):
+        self.cache.set('counter', 2 ** 63 - 2)
+        self.assertEqual(self.cache.incr('counter'), 2 ** 63 - 1)
+        with self.assertRaises(OverflowError):
+            self.cache.incr('counter')
+        self.assertEqual(self.cache.get('counter'), 2 ** 63 - 1)
+        self.assertEqual(self.cache.decr('counter'), 2 ** 63 - 2)
+
+    @mock.patch('core.cache_backends.sqlite.ACCESS_RESOLUTION', -1)
+    def test_least_recently_read_values_are_evicted(self):
+        lru = self.backend(MAX_ENTRIES=3, CULL_FREQUENCY=3, CULL_EVERY=1)
+        lru.set_many({'a': 1, 'b': 2, 'c': 3})
+        lru.get('a')
+        lru.set('d', 4)
+        self.assertEqual(lru.get_many(['a', 'b', 'c', 'd']), {'a': 1, 'd': 4})
+
+
+class TieredCacheTest(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings = override_settings(CACHES={
+            'default': {
+                'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            },
+            'shared': {
+                'BACKEND': 'core.cache_backends.sqlite.SQLiteCache',
+                'LOCATION': os.path.join(directory.name, 'cache.sqlite3'),
+            },
+        })
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.bus = os.path.join(directory.name, 'cache.bus')
+
+    def worker(self, poll_interval=0):
+        return TieredCache(self.bus, {'OPTIONS': {
+            'L2': 'shared', 'BUS_POLL_INTERVAL': poll_interval,
+        }})
+
+    def test_hot_values_are_served_from_l1(self):
+        worker = self.worker()
+        worker.set('group', 'Тестовая группа')
+        caches['shared'].set('group', 'изменено в обход L1')
+        self.assertEqual(worker.get('group'), 'Тестовая группа')
+        self.assertIsNone(worker.get('missing'))
+        stats = worker.tier_stats()
+        self.assertEqual(stats['l1_hits'], 1)
+        self.assertEqual(stats['l2_misses'], 1)
+
+    def test_invalidation_reaches_sibling_workers(self):
+        first, second = self.worker(), self.worker()
+        first.set_many({'page': 1, 'tag': 1})
+        self.assertEqual(
+            second.get_many(['page', 'tag']), {'page': 1, 'tag': 1}
+        )
+        first.set('page', 2)
+        first.delete('tag')
+        self.assertEqual(second.get_many(['page', 'tag']), {'page': 2})
+
+    def test_bus_is_polled_once_per_interval(self):
+        worker = self.worker(poll_interval=60)
+        worker.set('page', 1)
+        with mock.patch.object(
+            worker._bus, 'poll', wraps=worker._bus.poll
+        ) as poll:
+            for _ in range(5):
+                worker.get('page')
+        self.assertEqual(poll.call_count, 1)
+
+    def test_value_changed_during_l2_read_is_not_kept_in_l1(self):
+        worker, writer = self.worker(poll_interval=60), self.worker()
+        writer.set('page', 1)
+        l2 = caches['shared']
+        read = l2.get
+
+        def stale_read(key, version=None):
+            value = read(key, version=version)
+            writer.set('page', 2)
+            return value
+
+        with mock.patch.object(l2, 'get', side_effect=stale_read):
+            self.assertEqual(worker.get('page'), 1)
+        self.assertEqual(worker.get('page'), 2)
+
+    def test_invalidation_reaches_other_processes(self):
+        worker = self.worker()
+        worker.set('page', 1)
+        worker.get('page')
+        child = multiprocessing.get_context('fork').Process(
+            target=worker.set, args=('page', 2)
+        )
+        child.start()
+        child.join()
+        self.assertEqual(worker.get('page'), 2)
+
+
+class StampedeTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.calls = 0
+
+    def compute(self):
+        self.calls += 1
+        time.sleep(0.1)
+        return self.calls
+
+    def test_single_worker_recomputes_missing_value(self):
+        threads = [
+            threading.Thread(
+                target=get_or_compute, args=('feed', self.compute, 60)
+            )
+            for _ in range(5)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.calls, 1)
+
+    def test_stale_value_is_served_during_recompute(self):
+        get_or_compute('feed', self.compute, 60, version='v1')
+        cache.add(lease_key('feed'), 1)
+        self.assertEqual(
+            get_or_compute('feed', self.compute, 60, version='v2'), 1
+        )
+        cache.delete(lease_key('feed'))
+        self.assertEqual(
+            get_or_compute('feed', self.compute, 60, version='v2'), 2
+        )
+
+    def test_value_may_be_recomputed_before_expiry(self):
+        cache.set('feed', ('old', None, time.time() + 1, 1.0))
+        with mock.patch('core.stampede.random.random', return_value=0.0):
+            self.assertEqual(get_or_compute('feed', self.compute, 60), 'old')
+        with mock.patch('core.stampede.random.random', return_value=0.999):
+            self.assertEqual(get_or_compute('feed', self.compute, 60), 1)
+
+
+class PageCacheTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='auth')
+        cls.post = Post.objects.create(
+            author=cls.user, text='Пост', moderated=True
+        )
+
+    def setUp(self):
+        cache.clear()
+
+    def test_page_is_cached_until_its_tags_change(self):
+        url = reverse('posts:post_detail', kwargs={'post_id': self.post.pk})
+        self.assertTemplateUsed(self.client.get(url), 'posts/post_detail.html')
+        Post.objects.update(text='Тихо изменённый пост')
+        response = self.client.get(url)
+        self.assertTemplateNotUsed(response, 'posts/post_detail.html')
+        self.assertContains(response, 'Пост')
+        Post.objects.get().save()
+        self.assertContains(self.client.get(url), 'Тихо изменённый пост')
+
+    def test_logged_in_user_gets_cached_body_with_own_header(self):
+        url = reverse('posts:index')
+        self.assertNotContains(self.client.get(url), 'Избранные авторы')
+        self.client.force_login(self.user)
+        response = self.client.get(url)
+        self.assertTemplateNotUsed(response, 'posts/index.html')
+        self.assertContains(response, 'Пользователь: auth')
+        self.assertContains(response, 'Избранные авторы')
+        self.assertNotContains(response, '<!--hole:')
+
+    def test_unknown_params_share_cached_page(self):
+        url = reverse('posts:index')
+        self.client.get(url)
+        response = self.client.get(url, {'utm_source': 'mail', 'x': 1})
+        self.assertTemplateNotUsed(response, 'posts/index.html')
+
+    def test_broken_position_is_not_cached(self):
+        url = reverse('posts:index')
+        for params in ({'page': 0}, {'cursor': '%%%'}, {'page': 'x' * 200}):
+            with self.subTest(params=params):
+                self.client.get(url, params)
+                self.assertTemplateUsed(
+                    self.client.get(url, params), 'posts/index.html'
+                )
+        self.assertTemplateUsed(self.client.get(url), 'posts/index.html')
+
+    def test_personal_pages_are_not_cached_for_logged_in_users(self):
+        url = reverse('posts:profile', kwargs={'username': 'auth'})
+        self.client.get(url)
+        self.client.force_login(self.user)
+        self.assertTemplateUsed(self.client.get(url), 'posts/profile.html')
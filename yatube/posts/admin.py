@@ -1,6 +1,8 @@
 from django.contrib import admin
 
-from .models import Group, Post, Comment, Follow
+from .models import (
+    AuthorStats, Group, Post, Comment, Follow, TimelineEntry
+)
 
 
 class PostAdmin(admin.ModelAdmin):
@@ -41,7 +43,30 @@ class FollowAdmin(admin.ModelAdmin):
     list_filter = ('user',)
 
 
+class TimelineEntryAdmin(admin.ModelAdmin):
+    list_display = (
+        'pk',
+        'user',
+        'post',
+        'author',
+        'pub_date',
+    )
+    list_filter = ('user',)
+
+
+class AuthorStatsAdmin(admin.ModelAdmin):
+    list_display = (
+        'user',
+        'posts_count',
+        'followers_count',
+        'following_count',
+    )
+    search_fields = ('user__username',)
+
+
 admin.site.register(Post, PostAdmin)
 admin.site.register(Group)
 admin.site.register(Comment, CommentAdmin)
 admin.site.register(Follow, FollowAdmin)
+admin.site.register(TimelineEntry, TimelineEntryAdmin)
+admin.site.register(AuthorStats, AuthorStatsAdmin)
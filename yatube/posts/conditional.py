@@ -0,0 +1,40 @@
+"""Теги страниц для условных GET-запросов.
+
+Каждая функция обходится одним запросом по индексу или вовсе без него.
+"""
+from core.cache_tags import tag
+
+from .counts import FEED_AUTHOR, FEED_GROUP, FEED_INDEX
+from .feed_cache import follow_feed_tags, post_page_tags
+from .models import Group, Post, User
+from .timelines import following_authors
+
+
+def index_tags(request):
+    return [tag(FEED_INDEX)]
+
+
+def group_tags(request, slug):
+    pk = Group.objects.filter(slug=slug).values_list('pk', flat=True).first()
+    return None if pk is None else [tag(FEED_GROUP, pk)]
+
+
+def profile_tags(request, username):
+    pk = User.objects.filter(
+        username=username
+    ).values_list('pk', flat=True).first()
+    return None if pk is None else [tag(FEED_AUTHOR, pk)]
+
+
+def post_detail_tags(request, post_id):
+    if request.method != 'GET':
+        return None
+    post = Post.objects.filter(pk=post_id).only('author', 'group').first()
+    return None if post is None else post_page_tags(post)
+
+
+def follow_tags(request):
+    if not request.user.is_authenticated:
+        return None
+    _, pulled = following_authors(request.user)
+    return follow_feed_tags(request.user.pk, pulled)
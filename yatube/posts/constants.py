@@ -1 +1,73 @@
 POSTS_COUNT = 10
+
+# Ленты длиннее этого порога листаются по курсору, а не по номеру страницы.
+PAGE_MODE_MAX_POSTS = 1000
+
+# Сколько секунд хранится в кеше число постов ленты.
+FEED_COUNT_TTL = 60 * 15
+
+# Оценке планировщика верим только для больших таблиц.
+ESTIMATE_COUNT_FROM = 100_000
+
+# Сколько последних постов автора попадает в ленту нового подписчика.
+TIMELINE_BACKFILL_POSTS = 200
+
+# Размер пачки при раскладке поста по лентам подписчиков.
+TIMELINE_BATCH_SIZE = 1000
+
+# Посты авторов с таким числом подписчиков не раскладываются по лентам,
+# а подмешиваются в ленту при чтении.
+CELEBRITY_FOLLOWERS = 10_000
+
+# С этого числа подписок лента собирается слиянием списков последних
+# постов авторов вместо запроса к базе.
+KWAY_MERGE_MIN_FOLLOWING = 500
+
+# Длина и время жизни закешированного списка последних постов автора.
+RECENT_POSTS_PER_AUTHOR = 100
+RECENT_POSTS_TTL = 60 * 60
+
+# Сколько комментариев показывается на странице поста за раз.
+COMMENTS_COUNT = 20
+
+# Сколько секунд хранится отрисованная лента: кеш сбрасывается при
+# изменении постов, так что TTL лишь страхует от забытых сбросов.
+FEED_CACHE_TTL = 60 * 60 * 6
+
+# Сколько секунд хранится отрисованная карточка поста. Ключ карточки
+# меняется при каждом сохранении поста.
+POST_CARD_TTL = 60 * 60 * 24
+
+# Сколько секунд хранятся списки id постов ленты и сами посты.
+FEED_IDS_TTL = 60 * 60 * 6
+POST_OBJECT_TTL = 60 * 60
+
+# Размер основной миниатюры картинки поста и параметры sorl-thumbnail
+# для всех миниатюр. Остальные ширины из THUMBNAIL_WIDTHS рисуются с
+# теми же пропорциями.
+THUMBNAIL_GEOMETRY = '960x339'
+THUMBNAIL_OPTIONS = {'crop': 'center', 'upscale': True}
+
+# Атрибут sizes картинки: какую ширину миниатюра займёт на странице.
+THUMBNAIL_SIZES = '(min-width: 992px) 960px, 100vw'
+
+# Сколько секунд миниатюра считается поставленной в очередь.
+THUMBNAIL_JOB_TIMEOUT = 60 * 10
+
+# Через сколько секунд после сбоя картинку можно обрабатывать снова.
+THUMBNAIL_RETRY_DELAY = 30
+
+# Какими кусками читается загруженная картинка при подсчёте хеша.
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
+# Сколько постов с картинками просматривается за одну пачку переноса.
+SHARD_BATCH_SIZE = 500
+
+# Качество перекодированных при загрузке картинок. С прозрачностью
+# картинки сохраняются в WebP, остальные — в прогрессивный JPEG.
+IMAGE_JPEG_QUALITY = 85
+IMAGE_WEBP_QUALITY = 80
+
+# Форматы, которые перекодируются при загрузке. GIF остаётся как есть,
+# чтобы не потерять анимацию.
+NORMALIZED_FORMATS = ('JPEG', 'MPO', 'PNG', 'WEBP', 'BMP', 'TIFF')
@@ -0,0 +1,168 @@
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from .constants import (
+    CELEBRITY_FOLLOWERS, ESTIMATE_COUNT_FROM, FEED_COUNT_TTL
+)
+from .models import AuthorStats, Follow, Group, Post, User
+
+FEED_INDEX = 'index'
+FEED_GROUP = 'group'
+FEED_AUTHOR = 'author'
+FEED_FOLLOW = 'follow'
+FOLLOWERS = 'followers'
+
+
+def count_key(feed, pk=None):
+    return f'feed_count:{feed}:{pk}'
+
+
+def estimate_count(model):
+    """Оценка числа строк по статистике планировщика PostgreSQL.
+
+    Для остальных СУБД оценки нет, и возвращается None.
+    """
+    if connection.vendor != 'postgresql':
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT reltuples FROM pg_class WHERE relname = %s',
+            [model._meta.db_table],
+        )
+        row = cursor.fetchone()
+    return int(row[0]) if row and row[0] > 0 else None
+
+
+def feed_count(feed, pk, post_list):
+    """Число постов в ленте из кеша, оценки или точного COUNT(*)."""
+    key = count_key(feed, pk)
+    count = cache.get(key)
+    if count is not None:
+        return count
+    if feed == FEED_INDEX:
+        count = estimate_count(post_list.model)
+        if count is not None and count < ESTIMATE_COUNT_FROM:
+            count = None
+    if count is None:
+        count = post_list.count()
+    cache.set(key, count, FEED_COUNT_TTL)
+    return count
+
+
+def followers_counts(author_ids):
+    """Число подписчиков для каждого автора из кеша или AuthorStats."""
+    keys = {count_key(FOLLOWERS, pk): pk for pk in author_ids}
+    cached = cache.get_many(keys)
+    counts = {keys[key]: count for key, count in cached.items()}
+    missing = [pk for pk in author_ids if pk not in counts]
+    if missing:
+        found = dict(
+            AuthorStats.objects.filter(user_id__in=missing)
+            .values_list('user_id', 'followers_count')
+        )
+        fresh = {pk: found.get(pk, 0) for pk in missing}
+        cache.set_many(
+            {count_key(FOLLOWERS, pk): n for pk, n in fresh.items()},
+            FEED_COUNT_TTL,
+        )
+        counts.update(fresh)
+    return counts
+
+
+def is_celebrity(author_id):
+    return followers_counts([author_id])[author_id] >= CELEBRITY_FOLLOWERS
+
+
+def follower_ids(author_id):
+    """Подписчики, чьи ленты нужно сбрасывать при изменении поста.
+
+    Ленты подписчиков знаменитостей не сбрасываются: сотни тысяч ключей
+    на каждый пост слишком дорого, счётчики живут до истечения TTL.
+    """
+    if is_celebrity(author_id):
+        return []
+    return list(
+        Follow.objects.filter(author_id=author_id)
+        .values_list('user_id', flat=True)
+    )
+
+
+def invalidate_post_counts(post, followers, *group_ids):
+    keys = [count_key(FEED_INDEX), count_key(FEED_AUTHOR, post.author_id)]
+    keys += [count_key(FEED_GROUP, pk) for pk in group_ids if pk]
+    keys += [count_key(FEED_FOLLOW, pk) for pk in followers]
+    cache.delete_many(keys)
+
+
+def invalidate_follow_counts(user_id, author_id):
+    cache.delete_many([
+        count_key(FEED_FOLLOW, user_id),
+        count_key(FOLLOWERS, author_id),
+    ])
+
+
+def bump(queryset, field, delta):
+    """Сдвигает счётчик одним UPDATE, не опуская его ниже нуля."""
+    if delta < 0:
+        queryset = queryset.filter(**{f'{field}__gte': -delta})
+    queryset.update(**{field: F(field) + delta})
+
+
+def bump_group_counter(group_id, delta):
+    if group_id:
+        bump(Group.objects.filter(pk=group_id), 'posts_count', delta)
+
+
+def bump_post_counters(author_id, group_id, delta):
+    bump(AuthorStats.objects.filter(user_id=author_id), 'posts_count', delta)
+    bump_group_counter(group_id, delta)
+
+
+def bump_follow_counters(user_id, author_id, delta):
+    bump(
+        AuthorStats.objects.filter(user_id=user_id), 'following_count', delta
+    )
+    bump(
+        AuthorStats.objects.filter(user_id=author_id),
+        'followers_count',
+        delta,
+    )
+
+
+def subquery_count(queryset, field):
+    """Подзапрос COUNT(*) по queryset, сгруппированному по field."""
+    return Coalesce(Subquery(
+        queryset.order_by().values(field).annotate(
+            count=Count('pk')
+        ).values('count')
+    ), 0)
+
+
+def recount_counters():
+    """Пересчитывает все счётчики несколькими UPDATE по всей таблице."""
+    users_without_stats = User.objects.filter(
+        stats__isnull=True
+    ).values_list('pk', flat=True).iterator()
+    AuthorStats.objects.bulk_create(
+        [AuthorStats(user_id=pk) for pk in users_without_stats],
+        batch_size=1000,
+        ignore_conflicts=True,
+    )
+    AuthorStats.objects.update(
+        posts_count=subquery_count(
+            Post.objects.filter(author=OuterRef('user')), 'author'
+        ),
+        followers_count=subquery_count(
+            Follow.objects.filter(author=OuterRef('user')), 'author'
+        ),
+        following_count=subquery_count(
+            Follow.objects.filter(user=OuterRef('user')), 'user'
+        ),
+    )
+    Group.objects.update(
+        posts_count=subquery_count(
+            Post.objects.filter(group=OuterRef('pk')), 'group'
+        ),
+    )
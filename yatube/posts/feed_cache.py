@@ -0,0 +1,122 @@
+import itertools
+
+from django.core.cache import cache
+
+from core.cache_tags import invalidate_tags, tag, tagged_key
+from core.page_cache import page_tags
+
+from .constants import FEED_CACHE_TTL
+from .counts import (
+    FEED_AUTHOR, FEED_FOLLOW, FEED_GROUP, FEED_INDEX, follower_ids
+)
+from .hydration import ids_tag, object_key
+from .utils import feed_position
+
+POST = 'post'
+
+
+def feed_cache(request, *tags):
+    """Контекст для {% fragment_cache %} вокруг ленты.
+
+    Ключ фрагмента зависит от тегов ленты и позиции на странице, так что
+    вторая страница не получит закешированную первую. Версия — подпись
+    тегов: после сброса старый фрагмент отдаётся, пока один воркер
+    рисует новый. Ленту с испорченной позицией не кешируют (срок 0).
+    """
+    position = feed_position(request)
+    return {
+        'feed_cache_ttl': FEED_CACHE_TTL if position else 0,
+        'feed_cache_key': tagged_key('|'.join(position or ()), tags),
+        'feed_cache_version': page_tags(request, tags),
+    }
+
+
+def card_key(post, show_author):
+    """Ключ карточки поста: меняется при каждом сохранении поста."""
+    version = int(post.updated.timestamp() * 1_000_000)
+    return f'post_card:{post.pk}:{version}:{int(show_author)}'
+
+
+def follow_feed_tags(user_id, pulled):
+    return [
+        tag(FEED_FOLLOW, user_id),
+        *(tag(FEED_AUTHOR, pk) for pk in pulled),
+    ]
+
+
+def post_page_tags(post):
+    """Теги страницы поста: сам пост с комментариями, автор и группа."""
+    tags = [tag(POST, post.pk), tag(FEED_AUTHOR, post.author_id)]
+    if post.group_id:
+        tags.append(tag(FEED_GROUP, post.group_id))
+    return tags
+
+
+def post_view_tags(post, followers):
+    """Теги страниц, на которых виден пост, без тегов состава лент.
+
+    followers — подписчики автора, у которых пост лежит в timeline.
+    Ленты подписчиков знаменитостей зависят от тега автора.
+    """
+    tags = [
+        tag(POST, post.pk), tag(FEED_INDEX), tag(FEED_AUTHOR, post.author_id)
+    ]
+    group_ids = {post.group_id, getattr(post, '_old_group_id', None)}
+    tags += [tag(FEED_GROUP, pk) for pk in group_ids if pk]
+    tags += [tag(FEED_FOLLOW, pk) for pk in followers]
+    return tags
+
+
+def post_tags(post, followers, feeds_changed=True):
+    """Теги лент и страниц, на которых виден пост.
+
+    followers — подписчики автора, feeds_changed — пост появился в
+    лентах или пропал из них; только тогда сбрасываются теги их состава.
+    """
+    tags = post_view_tags(post, followers)
+    if feeds_changed:
+        tags += [ids_tag(name) for name in tags[1:]]
+    return tags
+
+
+def comment_tags(comment):
+    return [tag(POST, comment.post_id)]
+
+
+def group_tags(group):
+    return [tag(FEED_GROUP, group.pk)]
+
+
+def follow_tags_of(user_id, author_id):
+    # Число подписок видно на странице подписчика, а число подписчиков —
+    # на странице автора.
+    return [
+        tag(FEED_FOLLOW, user_id),
+        ids_tag(tag(FEED_FOLLOW, user_id)),
+        tag(FEED_AUTHOR, user_id),
+        tag(FEED_AUTHOR, author_id),
+    ]
+
+
+def follow_tags(follow):
+    return follow_tags_of(follow.user_id, follow.author_id)
+
+
+def refresh_posts(posts):
+    """Сбрасывает закешированные посты, их карточки и страницы с ними.
+
+    Нужен, когда меняется автор, группа или файл картинки в обход
+    save(): всё это выводится в карточке, а её ключ зависит только от
+    даты изменения самого поста.
+    """
+    posts = list(posts.only('pk', 'updated', 'author_id', 'group_id'))
+    followers = {
+        pk: follower_ids(pk) for pk in {post.author_id for post in posts}
+    }
+    cache.delete_many(
+        [object_key(post.pk) for post in posts]
+        + [card_key(post, show) for post in posts for show in (True, False)]
+    )
+    invalidate_tags(itertools.chain.from_iterable(
+        post_view_tags(post, followers[post.author_id]) for post in posts
+    ))
@@ -0,0 +1,82 @@
+"""Ленты из закешированных списков id и закешированных постов.
+
+Список id страницы зависит только от состава ленты: он сбрасывается,
+когда пост появляется в ленте или пропадает из неё. Правка поста
+сбрасывает один объект в кеше, а не списки всех лент с этим постом.
+"""
+from django.core.cache import cache
+
+from core.cache_tags import cached, tagged_key
+
+from .constants import FEED_IDS_TTL, POST_OBJECT_TTL
+from .models import Post
+from .utils import (
+    CursorPage, cursor_paginator_create, feed_position, paginator_create,
+    uses_cursor
+)
+
+
+def object_key(pk):
+    return f'post_obj:{pk}'
+
+
+def ids_tag(name):
+    """Тег состава ленты name."""
+    return f'{name}:ids'
+
+
+def hydrate(ids):
+    """Посты по списку id: из кеша одним get_many, промахи одним запросом."""
+    keys = {object_key(pk): pk for pk in ids}
+    posts = {keys[key]: post for key, post in cache.get_many(keys).items()}
+    missing = [pk for pk in ids if pk not in posts]
+    if missing:
+        fresh = Post.objects.select_related('author', 'group').in_bulk(
+            missing
+        )
+        cache.set_many(
+            {object_key(pk): post for pk, post in fresh.items()},
+            POST_OBJECT_TTL,
+        )
+        posts.update(fresh)
+    return [posts[pk] for pk in ids if pk in posts]
+
+
+def invalidate_post_object(post):
+    cache.delete(object_key(post.pk))
+
+
+def feed_page(post_list, request, count, tags):
+    """Страница ленты как page_create, но через кеш списков id.
+
+    tags — теги ленты; список id зависит от их тегов состава. Список ленты
+    с испорченной позицией не кешируется.
+    """
+    cursor = request.GET.get('cursor')
+    position = feed_position(request)
+    membership = [ids_tag(name) for name in tags]
+
+    def ids_of(load):
+        if position is None:
+            return load()
+        key = tagged_key(f'feed_ids|{"|".join(position)}', tags)
+        return cached(key, membership, FEED_IDS_TTL, load)
+
+    if uses_cursor(post_list, request, count):
+        def load():
+            page = cursor_paginator_create(
+                post_list.select_related(None).only('pk', 'pub_date'), cursor
+            )
+            return (
+                [post.pk for post in page],
+                page.has_next(),
+                page.has_previous(),
+            )
+
+        ids, has_next, has_previous = ids_of(load)
+        return CursorPage(hydrate(ids), has_next, has_previous)
+    page = paginator_create(post_list, request.GET.get('page'), count)
+    page.object_list = hydrate(ids_of(
+        lambda: list(page.object_list.values_list('pk', flat=True))
+    ))
+    return page
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from posts.counts import recount_counters
+
+
+class Command(BaseCommand):
+    help = (
+        'Пересчитывает счётчики постов, подписчиков и подписок '
+        'у авторов и групп.'
+    )
+
+    def handle(self, *args, **options):
+        recount_counters()
+        self.stdout.write(self.style.SUCCESS('Счётчики пересчитаны.'))
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from posts.constants import SHARD_BATCH_SIZE
+from posts.uploads import shard_images
+
+
+class Command(BaseCommand):
+    help = (
+        'Переносит картинки постов в каталоги по началу хеша. '
+        'Прерванный перенос можно запустить заново.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=SHARD_BATCH_SIZE,
+            help='Сколько постов просматривать за одну пачку.',
+        )
+
+    def handle(self, *args, **options):
+        total_moved = total_skipped = 0
+        for moved, skipped in shard_images(options['batch_size']):
+            total_moved += moved
+            total_skipped += skipped
+            self.stdout.write(
+                f'Перенесено файлов: {total_moved}, '
+                f'пропущено: {total_skipped}'
+            )
+        self.stdout.write(self.style.SUCCESS('Перенос завершён.'))
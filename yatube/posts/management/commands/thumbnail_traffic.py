@@ -0,0 +1,33 @@
+import fileinput
+
+from django.core.management.base import BaseCommand
+
+from posts.thumbnails import thumbnail_traffic
+
+
+class Command(BaseCommand):
+    help = (
+        'Считает запросы и байты, отданные по каждой ширине и формату '
+        'миниатюр, по журналу доступа веб-сервера.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'logs', nargs='+',
+            help='Файлы журнала в формате common или combined.',
+        )
+
+    def handle(self, *args, **options):
+        with fileinput.input(
+            options['logs'],
+            openhook=fileinput.hook_encoded('utf-8', 'replace'),
+        ) as lines:
+            traffic = thumbnail_traffic(lines)
+        total = sum(counts['bytes'] for counts in traffic.values())
+        for (width, fmt), counts in sorted(traffic.items()):
+            share = counts['bytes'] / (total or 1)
+            self.stdout.write(
+                f'{width:>6} {fmt:<5}{counts["requests"]:>10}'
+                f'{counts["bytes"]:>14}{share:>8.1%}'
+            )
+        self.stdout.write(f'Всего байт: {total}')
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.16 on 2026-10-18 06:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0021_auto_20261018_0547'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='image_original_size',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True, verbose_name='Размер загруженной картинки в байтах'),
+        ),
+    ]
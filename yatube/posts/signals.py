@@ -0,0 +1,109 @@
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from core import cache_tags
+
+from .counts import (
+    bump_group_counter, bump_post_counters, follower_ids,
+    invalidate_post_counts
+)
+from .feed_cache import (
+    comment_tags, follow_tags, group_tags, post_tags, refresh_posts
+)
+from .hydration import invalidate_post_object
+from .models import AuthorStats, Comment, Follow, Group, Post, User
+from .thumbnails import ready_thumbnail
+from .timelines import fan_out_post, invalidate_recent_posts
+from .uploads import attach_upload, normalize_upload
+
+
+# Поля пользователя, которые выводятся в карточке поста.
+CARD_USER_FIELDS = ('username', 'first_name', 'last_name')
+
+
+def card_fields(user):
+    return tuple(getattr(user, field) for field in CARD_USER_FIELDS)
+
+
+@receiver(pre_save, sender=Post)
+def remember_old_group(sender, instance, **kwargs):
+    instance._old_group_id = None
+    if instance.pk is not None:
+        instance._old_group_id = Post.objects.filter(
+            pk=instance.pk
+        ).values_list('group_id', flat=True).first()
+
+
+@receiver(pre_save, sender=Post)
+def store_image_metadata(sender, instance, **kwargs):
+    attach_upload(instance)
+
+
+@receiver(post_save, sender=Post)
+def post_saved(sender, instance, created, **kwargs):
+    old_group_id = getattr(instance, '_old_group_id', None)
+    if created:
+        bump_post_counters(instance.author_id, instance.group_id, 1)
+        fan_out_post(instance)
+        invalidate_recent_posts(instance)
+    elif old_group_id != instance.group_id:
+        bump_group_counter(old_group_id, -1)
+        bump_group_counter(instance.group_id, 1)
+    followers = follower_ids(instance.author_id)
+    feeds_changed = created or old_group_id != instance.group_id
+    invalidate_post_object(instance)
+    # Миниатюру новой картинки рисуют заранее, а не при первом показе.
+    if getattr(instance, '_uploaded', False):
+        normalize_upload(instance, followers)
+    else:
+        ready_thumbnail(instance, followers)
+    if feeds_changed:
+        invalidate_post_counts(
+            instance, followers, instance.group_id, old_group_id
+        )
+    # Теги сбрасываются последними: пост уже разложен по лентам.
+    cache_tags.invalidate_tags(post_tags(instance, followers, feeds_changed))
+
+
+@receiver(post_delete, sender=Post)
+def post_deleted(sender, instance, **kwargs):
+    bump_post_counters(instance.author_id, instance.group_id, -1)
+    invalidate_recent_posts(instance)
+    invalidate_post_object(instance)
+    followers = follower_ids(instance.author_id)
+    invalidate_post_counts(instance, followers, instance.group_id)
+    cache_tags.invalidate_tags(post_tags(instance, followers))
+
+
+@receiver(pre_save, sender=User)
+def remember_card_fields(sender, instance, update_fields=None, **kwargs):
+    instance._old_card_fields = None
+    # Вход сохраняет только last_login: карточки от него не зависят.
+    if instance.pk is None or (
+        update_fields is not None
+        and not set(CARD_USER_FIELDS) & set(update_fields)
+    ):
+        return
+    instance._old_card_fields = User.objects.filter(
+        pk=instance.pk
+    ).values_list(*CARD_USER_FIELDS).first()
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, created, **kwargs):
+    old_fields = getattr(instance, '_old_card_fields', None)
+    if created:
+        AuthorStats.objects.create(user=instance)
+    elif old_fields is not None and old_fields != card_fields(instance):
+        refresh_posts(instance.posts.all())
+
+
+@receiver(post_save, sender=Group)
+def group_saved(sender, instance, created, **kwargs):
+    if not created:
+        refresh_posts(instance.posts.all())
+
+
+cache_tags.register(Comment, comment_tags)
+cache_tags.register(Group, group_tags)
+cache_tags.register(Follow, follow_tags, delete=False)
@@ -0,0 +1,41 @@
+from django import template
+from django.core.cache import cache
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+from posts.constants import POST_CARD_TTL
+from posts.feed_cache import card_key
+from posts.thumbnails import ready_thumbnails
+
+register = template.Library()
+
+CARD_TEMPLATE = 'posts/includes/post_card.html'
+SEPARATOR = '\n<hr>\n'
+
+
+@register.simple_tag(takes_context=True)
+def post_cards(context, posts):
+    """Карточки постов страницы: одним get_many, рисуются только промахи."""
+    request = context.get('request')
+    # На странице автора его имя у каждого поста не выводится.
+    show_author = request is None or request.path[:9] != '/profile/'
+    keys = {card_key(post, show_author): post for post in posts}
+    cards = cache.get_many(keys)
+    # Миниатюры для всех недостающих карточек находятся разом.
+    thumbnails = ready_thumbnails(
+        [post for key, post in keys.items() if key not in cards]
+    )
+    missing = {}
+    for key, post in keys.items():
+        if key in cards:
+            continue
+        thumbnail = thumbnails[post.pk]
+        cards[key] = render_to_string(CARD_TEMPLATE, {
+            'post': post, 'show_author': show_author, 'thumbnail': thumbnail
+        })
+        # Карточка с заглушкой или неполным srcset не кешируется.
+        if not post.image or thumbnail and thumbnail.complete:
+            missing[key] = cards[key]
+    if missing:
+        cache.set_many(missing, POST_CARD_TTL)
+    return mark_safe(SEPARATOR.join(cards[key] for key in keys))
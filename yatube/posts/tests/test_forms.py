@@ -1,18 +1,34 @@
+import hashlib
+import io
+import os
 import shutil
 import tempfile
+import threading
+from unittest import mock
 
 from django.test import Client, TestCase, override_settings
 from django.urls import reverse
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.cache import cache
+from django.core.management import call_command
 
 from posts.models import Post, Group, User, Comment
+from PIL import Image
+
+from posts.thumbnails import job_key
+from posts.uploads import (
+    UPLOAD_FIELDS, normalized_image, sharded_image_path
+)
+from .test_views import InlineExecutor
 
 
 TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
 
 
-@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT, IMAGE_WORKERS=0)
 class PostFormTests(TestCase):
     @classmethod
     def setUpClass(cls):
@@ -73,10 +89,46 @@ class PostFormTests(TestCase):
             Post.objects.filter(
                 text='Тестовый текст нового поста',
                 group_id=1,
-                image='posts/small.gif',
+                image=sharded_image_path(
+                    hashlib.sha256(small_gif).hexdigest(), 'small.gif'
+                ),
             ).exists()
         )
 
+    def upload(self, name):
+        small_gif = (
+            b'\x47\x49\x46\x38\x39\x61\x02\x00'
+            b'\x01\x00\x80\x00\x00\x00\x00\x00'
+            b'\xFF\xFF\xFF\x21\xF9\x04\x00\x00'
+            b'\x00\x00\x00\x2C\x00\x00\x00\x00'
+            b'\x02\x00\x01\x00\x00\x02\x02\x0C'
+            b'\x0A\x00\x3B'
+        )
+        self.authorized_client.post(
+            reverse('posts:post_create'),
+            data={
+                'text': f'Пост с картинкой {name}',
+                'image': SimpleUploadedFile(name, small_gif),
+            },
+        )
+        return small_gif, Post.objects.get(text=f'Пост с картинкой {name}')
+
+    def test_upload_stores_image_metadata(self):
+        small_gif, post = self.upload('small.gif')
+        self.assertEqual((post.image_width, post.image_height), (2, 1))
+        self.assertEqual(post.image_size, len(small_gif))
+        self.assertEqual(
+            post.image_hash, hashlib.sha256(small_gif).hexdigest()
+        )
+
+    def test_identical_uploads_share_file(self):
+        _, first = self.upload('first.gif')
+        _, second = self.upload('second.gif')
+        self.assertEqual(second.image.name, first.image.name)
+        self.assertNotIn(
+            'second.gif', os.listdir(os.path.join(TEMP_MEDIA_ROOT, 'posts'))
+        )
+
     def test_edit_post(self):
         form_data = {
             'text': 'Редактированный тестовый текст нового поста',
@@ -174,3 +226,216 @@ class CommentFormTests(TestCase):
         last_comment_on_page = response.context.get('comments')[0]
         comment_text = last_comment_on_page.text
         self.assertEqual(comment_text, 'Тестовый текст комментария')
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT, IMAGE_WORKERS=0)
+class ShardImagesTests(TestCase):
+    SMALL_GIF = (
+        b'\x47\x49\x46\x38\x39\x61\x02\x00'
+        b'\x01\x00\x80\x00\x00\x00\x00\x00'
+        b'\xFF\xFF\xFF\x21\xF9\x04\x00\x00'
+        b'\x00\x00\x00\x2C\x00\x00\x00\x00'
+        b'\x02\x00\x01\x00\x00\x02\x02\x0C'
+        b'\x0A\x00\x3B'
+    )
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='auth')
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def flat_post(self, name, content):
+        """Пост с картинкой в плоском каталоге, как до переноса."""
+        name = default_storage.save(f'posts/{name}', ContentFile(content))
+        post = Post.objects.create(author=self.user, text=name)
+        Post.objects.filter(pk=post.pk).update(image=name)
+        return name
+
+    def shard(self):
+        call_command(
+            'shard_images', batch_size=1, stdout=open(os.devnull, 'w')
+        )
+
+    def test_images_move_to_hash_directories(self):
+        name = self.flat_post('old.gif', self.SMALL_GIF)
+        shared = Post.objects.create(author=self.user, text='Та же картинка')
+        Post.objects.filter(pk=shared.pk).update(image=name)
+        self.flat_post('broken.gif', b'not an image')
+
+        self.shard()
+
+        digest = hashlib.sha256(self.SMALL_GIF).hexdigest()
+        new_name = sharded_image_path(digest, 'old.gif')
+        self.assertEqual(
+            Post.objects.filter(image=new_name, image_hash=digest).count(), 2
+        )
+        self.assertTrue(default_storage.exists(new_name))
+        self.assertFalse(default_storage.exists(name))
+        post = Post.objects.get(image=new_name, text=name)
+        self.assertEqual(
+            (post.image_width, post.image_height, post.image_size),
+            (2, 1, len(self.SMALL_GIF)),
+        )
+        # Битый файл остаётся на месте.
+        self.assertTrue(Post.objects.filter(image='posts/broken.gif').exists())
+
+    def test_moved_posts_are_refreshed(self):
+        name = self.flat_post('fresh.gif', self.SMALL_GIF)
+        updated = Post.objects.get(text=name).updated
+        with mock.patch('posts.uploads.refresh_posts') as refresh:
+            self.shard()
+        refresh.assert_called_once()
+        self.assertGreater(Post.objects.get(text=name).updated, updated)
+
+    def test_rerun_skips_moved_images(self):
+        self.flat_post('first.gif', self.SMALL_GIF)
+        self.shard()
+        names = set(Post.objects.values_list('image', flat=True))
+        self.flat_post('second.gif', self.SMALL_GIF)
+
+        self.shard()
+
+        # Вторая копия переезжает в уже перенесённый файл.
+        self.assertEqual(
+            set(Post.objects.values_list('image', flat=True)), names
+        )
+        self.assertFalse(default_storage.exists('posts/second.gif'))
+
+
+@override_settings(
+    MEDIA_ROOT=TEMP_MEDIA_ROOT, IMAGE_WORKERS=0, IMAGE_MAX_SIDE=100
+)
+class NormalizeUploadTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='auth')
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.user)
+        # В TestCase транзакция не коммитится: задачи ставятся сразу.
+        for target in (
+            mock.patch(
+                'posts.uploads.transaction.on_commit',
+                side_effect=lambda func: func(),
+            ),
+            mock.patch(
+                'posts.workers.executor', return_value=InlineExecutor()
+            ),
+            mock.patch('posts.thumbnails.render'),
+        ):
+            target.start()
+            self.addCleanup(target.stop)
+
+    def image_file(self, name, mode='RGB', fmt='JPEG'):
+        buffer = io.BytesIO()
+        exif = Image.Exif()
+        exif[0x010F] = 'Камера'
+        Image.new(mode, (400, 200), 'red').save(
+            buffer, fmt, quality=100, exif=exif
+        )
+        return SimpleUploadedFile(name, buffer.getvalue())
+
+    def create(self, image):
+        self.client.post(
+            reverse('posts:post_create'),
+            data={'text': f'Пост {image.name}', 'image': image},
+        )
+        return Post.objects.get(text=f'Пост {image.name}')
+
+    def test_normalized_image_is_small_progressive_and_without_exif(self):
+        upload = self.image_file('big.jpg')
+        data, extension, width, height = normalized_image(upload)
+        self.assertEqual((extension, width, height), ('jpg', 100, 50))
+        self.assertLess(len(data), upload.size)
+        with Image.open(io.BytesIO(data)) as image:
+            self.assertTrue(image.info.get('progressive'))
+            self.assertNotIn('exif', image.info)
+
+    def compressed_photo(self, orientation=1):
+        """Уже сжатый снимок с EXIF: перекодирование его не уменьшит."""
+        exif = Image.Exif()
+        exif[0x010F] = 'Камера'
+        exif[0x0112] = orientation
+        noise = Image.frombytes('RGB', (80, 60), os.urandom(80 * 60 * 3))
+        buffer = io.BytesIO()
+        noise.save(buffer, 'JPEG', quality=30, exif=exif)
+        return SimpleUploadedFile('photo.jpg', buffer.getvalue())
+
+    def test_compressed_photo_loses_exif_without_recompression(self):
+        upload = self.compressed_photo()
+        data, extension, width, height = normalized_image(upload)
+        self.assertEqual((extension, width, height), ('jpg', 80, 60))
+        self.assertLess(len(data), upload.size)
+        upload.seek(0)
+        with Image.open(io.BytesIO(data)) as image, Image.open(upload) as old:
+            self.assertEqual(len(image.getexif()), 0)
+            self.assertEqual(image.tobytes(), old.tobytes())
+
+    def test_compressed_photo_is_rotated_by_exif(self):
+        data, extension, width, height = normalized_image(
+            self.compressed_photo(orientation=6)
+        )
+        self.assertEqual((extension, width, height), ('jpg', 60, 80))
+        with Image.open(io.BytesIO(data)) as image:
+            self.assertEqual(len(image.getexif()), 0)
+
+    def test_upload_is_replaced_with_normalized_image(self):
+        upload = self.image_file('photo.jpg')
+        post = self.create(upload)
+        self.assertTrue(post.image.name.endswith('/photo.jpg'))
+        self.assertEqual(
+            (post.image_width, post.image_height), (100, 50)
+        )
+        self.assertEqual(post.image_original_size, upload.size)
+        self.assertLess(post.image_size, upload.size)
+        upload.seek(0)
+        digest = hashlib.sha256(upload.read()).hexdigest()
+        self.assertFalse(
+            default_storage.exists(sharded_image_path(digest, 'photo.jpg'))
+        )
+
+    def test_repeated_upload_reuses_normalized_image(self):
+        first = self.create(self.image_file('copy.jpg'))
+        with mock.patch('posts.uploads.submit') as submit:
+            second = self.create(self.image_file('again.jpg'))
+        submit.assert_not_called()
+        self.assertEqual(second.image.name, first.image.name)
+        self.assertEqual(
+            [getattr(second, name) for name in UPLOAD_FIELDS],
+            [getattr(first, name) for name in UPLOAD_FIELDS],
+        )
+        self.assertNotEqual(first.image_original_hash, '')
+
+    def test_transparent_image_becomes_webp(self):
+        post = self.create(self.image_file('logo.png', 'RGBA', 'PNG'))
+        self.assertTrue(post.image.name.endswith('/logo.webp'))
+
+    @mock.patch('posts.thumbnails.THUMBNAIL_RETRY_DELAY', 0)
+    def test_failed_normalization_is_retried_soon(self):
+        with mock.patch(
+            'posts.uploads.normalized_image', side_effect=OSError('битый')
+        ), self.assertLogs('posts.uploads', 'ERROR'):
+            post = self.create(self.image_file('broken.jpg'))
+        self.assertIsNone(post.image_original_size)
+        self.assertIsNone(cache.get(job_key(post.image.name)))
+
+    def test_full_queue_keeps_original(self):
+        slots = threading.BoundedSemaphore(1)
+        slots.acquire()
+        with mock.patch('posts.workers._slots', slots):
+            post = self.create(self.image_file('queued.jpg'))
+        self.assertIsNone(post.image_original_size)
+        self.assertTrue(post.image.name.endswith('/queued.jpg'))
+        self.assertIsNone(cache.get(job_key(post.image.name)))
@@ -1,6 +1,10 @@
+import os
+
+from django.core.management import call_command
 from django.test import TestCase
 
-from ..models import Group, Post, User
+from ..models import AuthorStats, Follow, Group, Post, User
+from ..timelines import follow_author, unfollow_author
 
 
 class PostModelTest(TestCase):
@@ -53,3 +57,65 @@ class PostModelTest(TestCase):
             with self.subTest(field=field):
                 self.assertEqual(
                     post._meta.get_field(field).help_text, expected_value)
+
+
+class CountersTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='auth')
+        cls.reader = User.objects.create_user(username='reader')
+        cls.group = Group.objects.create(
+            title='Тестовая группа',
+            slug='test-slug',
+            description='Тестовое описание',
+        )
+
+    def assert_counters(self, user, **expected):
+        stats = AuthorStats.objects.get(user=user)
+        for field, value in expected.items():
+            with self.subTest(user=user, field=field):
+                self.assertEqual(getattr(stats, field), value)
+
+    def test_counters_follow_writes(self):
+        post = Post.objects.create(
+            author=self.author, group=self.group, text='Пост'
+        )
+        self.assert_counters(self.author, posts_count=1)
+        self.group.refresh_from_db()
+        self.assertEqual(self.group.posts_count, 1)
+
+        follow_author(self.reader, self.author)
+        follow_author(self.reader, self.author)
+        self.assert_counters(self.author, followers_count=1)
+        self.assert_counters(self.reader, following_count=1)
+
+        unfollow_author(self.reader, self.author)
+        unfollow_author(self.reader, self.author)
+        self.assert_counters(self.author, followers_count=0)
+        self.assert_counters(self.reader, following_count=0)
+
+        post.delete()
+        self.assert_counters(self.author, posts_count=0)
+        self.group.refresh_from_db()
+        self.assertEqual(self.group.posts_count, 0)
+
+    def test_recount_counters_repairs_drift(self):
+        Post.objects.create(author=self.author, group=self.group, text='Пост')
+        Follow.objects.create(user=self.reader, author=self.author)
+        AuthorStats.objects.update(
+            posts_count=7, followers_count=7, following_count=7
+        )
+        Group.objects.update(posts_count=7)
+        AuthorStats.objects.filter(user=self.reader).delete()
+
+        call_command('recount_counters', stdout=open(os.devnull, 'w'))
+
+        self.assert_counters(
+            self.author, posts_count=1, followers_count=1, following_count=0
+        )
+        self.assert_counters(
+            self.reader, posts_count=0, followers_count=0, following_count=1
+        )
+        self.group.refresh_from_db()
+        self.assertEqual(self.group.posts_count, 1)
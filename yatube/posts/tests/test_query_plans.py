@@ -0,0 +1,102 @@
+from unittest import mock
+
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from posts.constants import POSTS_COUNT
+from posts.models import Comment, Follow, Group, Post, User
+
+
+def query_plan(sql):
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+        return [row[-1] for row in cursor.fetchall()]
+
+
+def is_bad_step(step):
+    """Полный проход по таблице или сортировка во временном B-дереве."""
+    full_scan = step.startswith('SCAN') and 'USING' not in step
+    return full_scan or 'TEMP B-TREE' in step
+
+
+class FeedQueryPlanTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='auth')
+        cls.reader = User.objects.create_user(username='reader')
+        cls.group = Group.objects.create(
+            title='Тестовая группа',
+            slug='test-slug',
+            description='Тестовое описание',
+        )
+        Follow.objects.create(user=cls.reader, author=cls.author)
+        for i in range(2 * POSTS_COUNT + 3):
+            Post.objects.create(
+                author=cls.author, group=cls.group, text=f'Пост {i}'
+            )
+        cls.post = Post.objects.first()
+        Comment.objects.create(
+            post=cls.post, author=cls.reader, text='Комментарий'
+        )
+
+    def setUp(self):
+        self.client.force_login(self.reader)
+        cache.clear()
+
+    def assert_no_bad_plans(self, url):
+        """Планы запросов первой и следующей страницы: по номеру или по
+        курсору, смотря в каком режиме отдана лента."""
+        with CaptureQueriesContext(connection) as queries:
+            page_obj = self.client.get(url).context.get('page_obj')
+            if page_obj is not None and page_obj.has_next():
+                next_cursor = getattr(page_obj, 'next_cursor', None)
+                if next_cursor is not None:
+                    params = {'cursor': next_cursor()}
+                else:
+                    params = {'page': page_obj.next_page_number()}
+                self.client.get(url, params)
+        for query in queries.captured_queries:
+            sql = query['sql']
+            if not sql.startswith('SELECT'):
+                continue
+            for step in query_plan(sql):
+                with self.subTest(url=url, sql=sql, step=step):
+                    self.assertFalse(is_bad_step(step))
+
+    def feed_urls(self):
+        return (
+            reverse('posts:index'),
+            reverse('posts:group_list', kwargs={'slug': 'test-slug'}),
+            reverse('posts:profile', kwargs={'username': 'auth'}),
+            reverse('posts:follow_index'),
+            reverse('posts:post_detail', kwargs={'post_id': self.post.pk}),
+            reverse('posts:post_comments', kwargs={'post_id': self.post.pk}),
+        )
+
+    def test_page_mode_queries_use_indexes(self):
+        for url in self.feed_urls():
+            self.assert_no_bad_plans(url)
+
+    @mock.patch('posts.utils.PAGE_MODE_MAX_POSTS', POSTS_COUNT)
+    @mock.patch('posts.timelines.PAGE_MODE_MAX_POSTS', POSTS_COUNT)
+    def test_cursor_mode_queries_use_indexes(self):
+        for url in self.feed_urls():
+            self.assert_no_bad_plans(url)
+
+    def test_follow_lookups_use_indexes(self):
+        lookups = (
+            Follow.objects.filter(user=self.reader, author=self.author),
+            Follow.objects.filter(author=self.author),
+        )
+        for queryset in lookups:
+            sql, params = queryset.query.sql_with_params()
+            with connection.cursor() as cursor:
+                cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+                plan = [row[-1] for row in cursor.fetchall()]
+            for step in plan:
+                with self.subTest(sql=sql, step=step):
+                    self.assertFalse(is_bad_step(step))
@@ -1,15 +1,40 @@
 import shutil
 import tempfile
+import time
+from concurrent.futures import Future
+from unittest import mock
 
-from django.test import Client, TestCase, override_settings
+from django.test import Client, RequestFactory, TestCase, override_settings
 from django.urls import reverse
 from django import forms
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import IntegrityError, connection
+from django.db.models.functions import Now
+from django.test.utils import CaptureQueriesContext
 from django.core.cache import cache
+from django.core.paginator import Paginator
+from django.template.loader import render_to_string
+from django.core.files.storage import default_storage
+from sorl.thumbnail.images import ImageFile, serialize_image_file
+from sorl.thumbnail.kvstores.base import KVStoreBase, add_prefix
+from sorl.thumbnail.models import KVStore
 
-from posts.models import Post, Group, User, Follow
-from posts.constants import POSTS_COUNT
+from posts.models import (
+    Comment, Post, Group, User, Follow, TimelineEntry
+)
+from posts.constants import (
+    COMMENTS_COUNT, POSTS_COUNT, THUMBNAIL_OPTIONS
+)
+from posts.counts import FEED_AUTHOR, FEED_GROUP, count_key
+from posts.hydration import feed_page, object_key
+from posts.timelines import follow_author, recent_posts
+from posts import workers
+from posts.thumbnails import (
+    backend, check_formats, job_key, ready_thumbnails, schedule,
+    thumbnail_traffic, variants
+)
 
 
 TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
@@ -58,7 +83,7 @@ class PostsTemplateTests(TestCase):
                 self.assertTemplateUsed(response, template)
 
 
-@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT, IMAGE_WORKERS=0)
 class PostsPagesTest(TestCase):
     @classmethod
     def setUpClass(cls):
@@ -208,18 +233,19 @@ class PostsPagesTest(TestCase):
     def test_index_page_cache(self):
         response = self.client.get(reverse('posts:index'))
         page_initial = response.content
+        # UPDATE в обход сигналов не сбрасывает кеш ленты.
+        Post.objects.update(text='Тихо изменённый пост')
+        response = self.client.get(reverse('posts:index'))
+        page_cached = response.content
         Post.objects.create(
             author=self.user_1,
             text='Totaly new post!',
         )
         response = self.client.get(reverse('posts:index'))
         page_after_adding_post = response.content
-        cache.clear()
-        response = self.client.get(reverse('posts:index'))
-        page_cleared_cache = response.content
 
-        self.assertEqual(page_initial, page_after_adding_post)
-        self.assertNotEqual(page_initial, page_cleared_cache)
+        self.assertEqual(page_initial, page_cached)
+        self.assertNotEqual(page_initial, page_after_adding_post)
 
 
 class PaginatorViewsTest(TestCase):
@@ -269,6 +295,532 @@ class PaginatorViewsTest(TestCase):
                 )
 
 
+class SyntheticPostList:
+    """Список на 10 млн строк, который не хранит сами строки."""
+
+    def count(self):
+        return 10_000_000
+
+    def __getitem__(self, index):
+        return list(range(index.start, index.stop))
+
+
+class PaginatorRenderBenchmarkTest(TestCase):
+    def test_paginator_output_size_is_constant(self):
+        paginator = Paginator(SyntheticPostList(), POSTS_COUNT)
+        sizes = {}
+        for number in (1, 2, 500_000, paginator.num_pages - 1,
+                       paginator.num_pages):
+            page_obj = paginator.page(number)
+            started = time.perf_counter()
+            html = render_to_string(
+                'posts/includes/paginator.html', {'page_obj': page_obj}
+            )
+            elapsed = time.perf_counter() - started
+            sizes[number] = len(html)
+            with self.subTest(page=number):
+                self.assertLess(len(html), 5_000)
+                self.assertLess(elapsed, 0.5)
+        self.assertLess(max(sizes.values()) - min(sizes.values()), 1_000)
+
+
+@mock.patch('posts.utils.PAGE_MODE_MAX_POSTS', POSTS_COUNT)
+class CursorPaginatorViewsTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='auth')
+        Post.objects.bulk_create(
+            [
+                Post(author=cls.user, text=f'Пост номер {i}')
+                for i in range(2 * POSTS_COUNT + 3)
+            ]
+        )
+
+    def setUp(self):
+        cache.clear()
+
+    def test_large_feed_uses_cursor_pages(self):
+        expected = list(Post.objects.order_by('-pub_date', '-pk'))
+        url = reverse('posts:profile', kwargs={'username': 'auth'})
+        seen = []
+        response = self.client.get(url)
+        page_obj = response.context['page_obj']
+        self.assertTrue(page_obj.is_cursor)
+        self.assertFalse(page_obj.has_previous())
+        while True:
+            seen.extend(page_obj)
+            if not page_obj.has_next():
+                break
+            response = self.client.get(
+                url, {'cursor': page_obj.next_cursor()}
+            )
+            page_obj = response.context['page_obj']
+        self.assertEqual(seen, expected)
+
+    def test_previous_cursor_returns_same_page(self):
+        url = reverse('posts:index')
+        first = self.client.get(url).context['page_obj']
+        second = self.client.get(
+            url, {'cursor': first.next_cursor()}
+        ).context['page_obj']
+        back = self.client.get(
+            url, {'cursor': second.previous_cursor()}
+        ).context['page_obj']
+        self.assertEqual(list(back), list(first))
+        self.assertFalse(back.has_previous())
+
+    def test_broken_cursor_shows_first_page(self):
+        response = self.client.get(
+            reverse('posts:index'), {'cursor': 'не-курсор'}
+        )
+        self.assertEqual(len(response.context['page_obj']), POSTS_COUNT)
+
+
+@mock.patch('posts.timelines.KWAY_MERGE_MIN_FOLLOWING', 1)
+class MergedFollowFeedTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.reader = User.objects.create_user(username='reader')
+        authors = [
+            User.objects.create_user(username=f'author_{i}')
+            for i in range(3)
+        ]
+        for author in authors:
+            Follow.objects.create(user=cls.reader, author=author)
+        for i in range(2 * POSTS_COUNT + 3):
+            Post.objects.create(
+                author=authors[i % len(authors)], text=f'Пост {i}'
+            )
+
+    def setUp(self):
+        self.client.force_login(self.reader)
+        cache.clear()
+
+    def test_pages_are_merged_from_author_lists(self):
+        expected = list(Post.objects.order_by('-pub_date', '-pk'))
+        url = reverse('posts:follow_index')
+        response = self.client.get(url)
+        self.assertIn('kway', response['Server-Timing'])
+        page_obj = response.context['page_obj']
+        seen = list(page_obj)
+        while page_obj.has_next():
+            page_obj = self.client.get(
+                url, {'cursor': page_obj.next_cursor()}
+            ).context['page_obj']
+            seen.extend(page_obj)
+        self.assertEqual(seen, expected)
+        back = self.client.get(
+            url, {'cursor': page_obj.previous_cursor()}
+        ).context['page_obj']
+        self.assertEqual(list(back), expected[POSTS_COUNT:2 * POSTS_COUNT])
+
+    @mock.patch('posts.timelines.RECENT_POSTS_PER_AUTHOR', 2)
+    def test_author_lists_are_loaded_in_one_query(self):
+        author_ids = list(
+            Follow.objects.filter(user=self.reader)
+            .values_list('author_id', flat=True)
+        )
+        with self.assertNumQueries(1):
+            streams = recent_posts(author_ids)
+        for author_id in author_ids:
+            with self.subTest(author_id=author_id):
+                self.assertEqual(
+                    streams[author_id],
+                    list(
+                        Post.objects.filter(author_id=author_id)
+                        .order_by('-pub_date', '-pk')
+                        .values_list('pub_date', 'pk')[:2]
+                    ),
+                )
+        with self.assertNumQueries(0):
+            recent_posts(author_ids)
+
+    @mock.patch('posts.timelines.RECENT_POSTS_PER_AUTHOR', 2)
+    def test_deep_page_falls_back_to_database(self):
+        response = self.client.get(reverse('posts:follow_index'))
+        self.assertIn('query', response['Server-Timing'])
+        self.assertEqual(
+            list(response.context['page_obj']),
+            list(Post.objects.order_by('-pub_date', '-pk')[:POSTS_COUNT]),
+        )
+
+
+class TimelinePagesTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.reader = User.objects.create_user(username='reader')
+        authors = [
+            User.objects.create_user(username=f'author_{i}')
+            for i in range(3)
+        ]
+        for author in authors:
+            follow_author(cls.reader, author)
+        for i in range(2 * POSTS_COUNT + 3):
+            Post.objects.create(
+                author=authors[i % len(authors)], text=f'Пост {i}'
+            )
+        cls.expected = list(Post.objects.order_by('-pub_date', '-pk'))
+
+    def setUp(self):
+        self.client.force_login(self.reader)
+        cache.clear()
+
+    def test_pages_are_read_from_timeline(self):
+        response = self.client.get(reverse('posts:follow_index'), {'page': 2})
+        self.assertIn('pages', response['Server-Timing'])
+        self.assertEqual(
+            list(response.context['page_obj']),
+            self.expected[POSTS_COUNT:2 * POSTS_COUNT],
+        )
+
+    @mock.patch('posts.counts.CELEBRITY_FOLLOWERS', 1)
+    @mock.patch('posts.timelines.CELEBRITY_FOLLOWERS', 1)
+    def test_pulled_posts_already_in_timeline_are_shown_once(self):
+        response = self.client.get(reverse('posts:follow_index'), {'page': 2})
+        self.assertIn('pulled 3 of 3', response['Server-Timing'])
+        self.assertIn('pages', response['Server-Timing'])
+        self.assertEqual(
+            list(response.context['page_obj']),
+            self.expected[POSTS_COUNT:2 * POSTS_COUNT],
+        )
+
+
+class PostCommentsTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='auth')
+        cls.post = Post.objects.create(author=cls.user, text='Пост')
+
+    def setUp(self):
+        # Вошедшим пользователям страница поста рисуется без кеша.
+        self.client.force_login(self.user)
+        cache.clear()
+
+    def add_comments(self, count):
+        Comment.objects.bulk_create(
+            [
+                Comment(
+                    post=self.post,
+                    author=User.objects.create_user(username=f'reader_{i}'),
+                    text=f'Комментарий {i}',
+                ) for i in range(Comment.objects.count(), count)
+            ]
+        )
+
+    def test_post_detail_queries_do_not_grow_with_comments(self):
+        url = reverse('posts:post_detail', kwargs={'post_id': self.post.pk})
+        self.add_comments(2)
+        with CaptureQueriesContext(connection) as few:
+            self.client.get(url)
+        self.add_comments(COMMENTS_COUNT + 5)
+        with CaptureQueriesContext(connection) as many:
+            response = self.client.get(url)
+        self.assertEqual(len(many), len(few))
+        self.assertEqual(len(response.context['comments']), COMMENTS_COUNT)
+
+    def test_comments_fragment_continues_from_cursor(self):
+        self.add_comments(COMMENTS_COUNT + 5)
+        expected = list(Comment.objects.order_by('-created', '-pk'))
+        first = self.client.get(
+            reverse('posts:post_detail', kwargs={'post_id': self.post.pk})
+        ).context['comments']
+        response = self.client.get(
+            reverse('posts:post_comments', kwargs={'post_id': self.post.pk}),
+            {'cursor': first.next_cursor()},
+        )
+        self.assertTemplateNotUsed(response, 'base.html')
+        rest = response.context['comments']
+        self.assertEqual(list(first) + list(rest), expected)
+        self.assertFalse(rest.has_next())
+
+    def test_comments_of_missing_post_are_not_found(self):
+        response = self.client.get(
+            reverse('posts:post_comments', kwargs={'post_id': 0})
+        )
+        self.assertEqual(response.status_code, 404)
+
+
+class FeedCountTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='auth')
+        cls.group = Group.objects.create(
+            title='Тестовая группа',
+            slug='test-slug',
+            description='Тестовое описание',
+        )
+        Post.objects.create(author=cls.user, text='Первый пост')
+
+    def setUp(self):
+        self.client.force_login(self.user)
+        cache.clear()
+
+    def test_profile_count_is_cached(self):
+        url = reverse('posts:profile', kwargs={'username': 'auth'})
+        response = self.client.get(url)
+        self.assertEqual(response.context['page_obj'].paginator.count, 1)
+        self.assertEqual(cache.get(count_key(FEED_AUTHOR, self.user.pk)), 1)
+        cache.set(count_key(FEED_AUTHOR, self.user.pk), 42)
+        response = self.client.get(url)
+        self.assertEqual(response.context['page_obj'].paginator.count, 42)
+
+    def test_post_changes_invalidate_counts(self):
+        self.client.get(reverse('posts:profile', kwargs={'username': 'auth'}))
+        self.client.get(
+            reverse('posts:group_list', kwargs={'slug': 'test-slug'})
+        )
+        post = Post.objects.create(author=self.user, text='Второй пост')
+        self.assertIsNone(cache.get(count_key(FEED_AUTHOR, self.user.pk)))
+
+        self.client.get(
+            reverse('posts:group_list', kwargs={'slug': 'test-slug'})
+        )
+        self.assertEqual(cache.get(count_key(FEED_GROUP, self.group.pk)), 0)
+        post.group = self.group
+        post.save()
+        self.assertIsNone(cache.get(count_key(FEED_GROUP, self.group.pk)))
+
+
+class FeedCacheTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='auth')
+        cls.reader = User.objects.create_user(username='reader')
+        Follow.objects.create(user=cls.reader, author=cls.author)
+        for i in range(POSTS_COUNT + 1):
+            Post.objects.create(
+                author=cls.author, text=f'Пост {i}', moderated=True
+            )
+
+    def setUp(self):
+        self.client.force_login(self.reader)
+        cache.clear()
+
+    def test_pages_are_cached_separately(self):
+        url = reverse('posts:index')
+        first = self.client.get(url).content
+        second = self.client.get(url, {'page': 2}).content
+        self.assertNotEqual(first, second)
+        self.assertContains(self.client.get(url, {'page': 2}), 'Пост 0')
+
+    def test_follow_feed_is_cached_per_user(self):
+        url = reverse('posts:follow_index')
+        self.client.get(url)
+        # Версия карточки меняется, но сигналы не отправляются.
+        Post.objects.update(text='Тихо изменённый пост', updated=Now())
+        self.assertNotContains(self.client.get(url), 'Тихо изменённый пост')
+
+        # Сами посты тоже лежат в кеше, а сигналов не было.
+        pks = Post.objects.values_list('pk', flat=True)
+        cache.delete_many([object_key(pk) for pk in pks])
+        self.client.force_login(User.objects.create_user(username='other'))
+        self.client.get(
+            reverse('posts:profile_follow', kwargs={'username': 'auth'})
+        )
+        self.assertContains(self.client.get(url), 'Тихо изменённый пост')
+
+    def test_author_post_invalidates_follower_feed(self):
+        url = reverse('posts:follow_index')
+        self.client.get(url)
+        Post.objects.create(
+            author=self.author, text='Свежий пост', moderated=True
+        )
+        self.assertContains(self.client.get(url), 'Свежий пост')
+
+    def test_post_delete_invalidates_feeds(self):
+        urls = (
+            reverse('posts:index'),
+            reverse('posts:profile', kwargs={'username': 'auth'}),
+            reverse('posts:follow_index'),
+        )
+        for url in urls:
+            self.client.get(url)
+        Post.objects.filter(text=f'Пост {POSTS_COUNT}').get().delete()
+        for url in urls:
+            with self.subTest(url=url):
+                self.assertNotContains(
+                    self.client.get(url), f'Пост {POSTS_COUNT}<'
+                )
+
+
+class ConditionalGetTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='auth')
+        cls.group = Group.objects.create(
+            title='Тестовая группа',
+            slug='test-slug',
+            description='Тестовое описание',
+        )
+        cls.post = Post.objects.create(
+            author=cls.author, group=cls.group, text='Пост'
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.urls = (
+            reverse('posts:index'),
+            reverse('posts:group_list', kwargs={'slug': 'test-slug'}),
+            reverse('posts:profile', kwargs={'username': 'auth'}),
+            reverse('posts:post_detail', kwargs={'post_id': self.post.pk}),
+        )
+
+    def test_unchanged_pages_are_not_modified(self):
+        for url in self.urls:
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                with CaptureQueriesContext(connection) as queries:
+                    again = self.client.get(
+                        url, HTTP_IF_NONE_MATCH=response['ETag']
+                    )
+                self.assertEqual(again.status_code, 304)
+                self.assertLessEqual(len(queries), 1)
+                self.assertFalse(response.has_header('Last-Modified'))
+
+    def test_new_post_changes_validators(self):
+        etags = {url: self.client.get(url)['ETag'] for url in self.urls}
+        Post.objects.create(author=self.author, group=self.group, text='Ещё')
+        Comment.objects.create(
+            post=self.post, author=self.author, text='Комментарий'
+        )
+        for url, etag in etags.items():
+            with self.subTest(url=url):
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 200)
+
+    def test_etag_depends_on_user(self):
+        etag = self.client.get(self.urls[0])['ETag']
+        self.client.force_login(self.author)
+        response = self.client.get(self.urls[0], HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_follow_feed_is_not_modified_until_followed_author_posts(self):
+        reader = User.objects.create_user(username='reader')
+        self.client.force_login(reader)
+        self.client.get(
+            reverse('posts:profile_follow', kwargs={'username': 'auth'})
+        )
+        url = reverse('posts:follow_index')
+        etag = self.client.get(url)['ETag']
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        Post.objects.create(author=self.author, text='Ещё')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+
+class FeedIdsCacheTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='auth')
+        for i in range(POSTS_COUNT + 1):
+            Post.objects.create(
+                author=cls.author, text=f'Пост {i}', moderated=True
+            )
+
+    def setUp(self):
+        cache.clear()
+        self.request = RequestFactory().get(reverse('posts:index'))
+
+    def page(self):
+        post_list = Post.objects.select_related('author', 'group')
+        return feed_page(
+            post_list, self.request, POSTS_COUNT + 1, ['index']
+        )
+
+    def test_edit_reloads_only_edited_post(self):
+        post = self.page()[0]
+        post.text = 'Исправленный пост'
+        post.save()
+        with CaptureQueriesContext(connection) as queries:
+            page = self.page()
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(page[0].text, 'Исправленный пост')
+        self.assertEqual(len(page), POSTS_COUNT)
+
+    def test_new_post_changes_id_list(self):
+        self.page()
+        post = Post.objects.create(
+            author=self.author, text='Свежий пост', moderated=True
+        )
+        self.assertEqual(self.page()[0], post)
+
+
+class PostCardCacheTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='auth')
+        for i in range(POSTS_COUNT):
+            Post.objects.create(
+                author=cls.author, text=f'Пост {i}', moderated=True
+            )
+
+    def setUp(self):
+        cache.clear()
+
+    def test_cards_are_reused_across_feeds(self):
+        self.client.get(reverse('posts:index'))
+        with mock.patch(
+            'posts.templatetags.post_cards.render_to_string'
+        ) as render:
+            response = self.client.get(
+                reverse('posts:index'), {'page': 1}
+            )
+        render.assert_not_called()
+        self.assertContains(response, 'Пост 0')
+
+    def test_saved_post_gets_new_card(self):
+        self.client.get(reverse('posts:index'))
+        post = Post.objects.get(text='Пост 0')
+        post.text = 'Исправленный пост'
+        post.save()
+        response = self.client.get(reverse('posts:index'))
+        self.assertContains(response, 'Исправленный пост')
+        self.assertNotContains(response, 'Пост 0')
+
+    def test_renamed_author_gets_new_cards(self):
+        self.client.get(reverse('posts:index'))
+        self.author.first_name, self.author.last_name = 'Лев', 'Толстой'
+        self.author.save()
+        self.assertContains(
+            self.client.get(reverse('posts:index')), 'Автор: Лев Толстой'
+        )
+
+    def test_unchanged_author_save_keeps_cards(self):
+        self.client.get(reverse('posts:index'))
+        with mock.patch('posts.signals.refresh_posts') as refresh:
+            User.objects.get(pk=self.author.pk).save()
+        refresh.assert_not_called()
+
+    def test_changed_group_slug_gets_new_cards(self):
+        group = Group.objects.create(title='Группа', slug='old-slug')
+        Post.objects.update(group=group)
+        self.client.get(reverse('posts:index'))
+        group.slug = 'new-slug'
+        group.save()
+        response = self.client.get(reverse('posts:index'))
+        self.assertContains(response, '/group/new-slug/')
+        self.assertNotContains(response, '/group/old-slug/')
+
+    def test_login_keeps_cards(self):
+        self.client.get(reverse('posts:index'))
+        self.client.force_login(self.author)
+        with mock.patch(
+            'posts.templatetags.post_cards.render_to_string'
+        ) as render:
+            self.client.get(reverse('posts:index'), {'page': 1})
+        render.assert_not_called()
+
+
 class AuthorSubcribtionTest(TestCase):
     @classmethod
     def setUpClass(cls):
@@ -351,3 +903,345 @@ class AuthorSubcribtionTest(TestCase):
         self.assertNotEqual(
             first_post_on_page.text, 'Новый пост второго автора'
         )
+
+    def test_follow_is_single_idempotent_statement(self):
+        url = reverse('posts:profile_follow', args=['first_auth'])
+        with CaptureQueriesContext(connection) as queries:
+            self.authorized_client_1.get(url)
+        follow_sql = [
+            query['sql'] for query in queries.captured_queries
+            if 'INTO "posts_follow"' in query['sql']
+            or query['sql'].startswith('SELECT (1) AS "a" FROM "posts_follow"')
+        ]
+        self.assertEqual(len(follow_sql), 1)
+        self.assertTrue(follow_sql[0].startswith('INSERT'))
+        self.authorized_client_1.get(url)
+        self.assertEqual(
+            Follow.objects.filter(
+                user=self.user_1, author=self.author_1
+            ).count(),
+            1
+        )
+        with self.assertRaises(IntegrityError):
+            Follow.objects.create(user=self.user_1, author=self.author_1)
+
+    def test_unfollow_is_single_statement(self):
+        Follow.objects.create(user=self.user_1, author=self.author_1)
+        with CaptureQueriesContext(connection) as queries:
+            self.authorized_client_1.get(
+                reverse('posts:profile_unfollow', args=['first_auth'])
+            )
+        follow_sql = [
+            query['sql'] for query in queries.captured_queries
+            if query['sql'].startswith(('DELETE FROM "posts_follow"',
+                                        'SELECT "posts_follow"'))
+        ]
+        self.assertEqual(len(follow_sql), 1)
+        self.assertTrue(follow_sql[0].startswith('DELETE'))
+        self.assertFalse(Follow.objects.exists())
+
+    def test_follow_updates_follower_profile(self):
+        url = reverse('posts:profile', args=['user_1'])
+        self.assertContains(self.client.get(url), 'подписок: 0')
+        self.authorized_client_1.get(
+            reverse('posts:profile_follow', args=['first_auth'])
+        )
+        self.assertContains(self.client.get(url), 'подписок: 1')
+        self.authorized_client_1.get(
+            reverse('posts:profile_unfollow', args=['first_auth'])
+        )
+        self.assertContains(self.client.get(url), 'подписок: 0')
+
+    def test_follow_timeline_is_materialized(self):
+        self.authorized_client_1.get(
+            reverse('posts:profile_follow', args=['first_auth'])
+        )
+        timeline = TimelineEntry.objects.filter(user=self.user_1)
+        self.assertEqual(
+            list(timeline.values_list('post', flat=True)),
+            list(self.author_1.posts.values_list('pk', flat=True)),
+        )
+        new_post = Post.objects.create(
+            author=self.author_1,
+            text='Новый пост первого автора',
+        )
+        self.assertTrue(timeline.filter(post=new_post).exists())
+        self.assertFalse(
+            TimelineEntry.objects.filter(user=self.user_2).exists()
+        )
+        self.authorized_client_1.get(
+            reverse('posts:profile_unfollow', args=['first_auth'])
+        )
+        self.assertFalse(timeline.exists())
+
+    def test_celebrity_posts_are_pulled(self):
+        with mock.patch('posts.counts.CELEBRITY_FOLLOWERS', 1), \
+                mock.patch('posts.timelines.CELEBRITY_FOLLOWERS', 1):
+            self.authorized_client_1.get(
+                reverse('posts:profile_follow', args=['first_auth'])
+            )
+            Post.objects.create(
+                author=self.author_1,
+                text='Новый пост первого автора',
+            )
+            response = self.authorized_client_1.get(
+                reverse('posts:follow_index')
+            )
+        self.assertFalse(
+            TimelineEntry.objects.filter(user=self.user_1).exists()
+        )
+        self.assertEqual(
+            [post.text for post in response.context['page_obj']],
+            ['Новый пост первого автора', 'Тестовый пост первого автора'],
+        )
+        self.assertIn('pulled 1 of 1', response['Server-Timing'])
+
+    def test_former_celebrity_posts_are_backfilled(self):
+        with mock.patch('posts.counts.CELEBRITY_FOLLOWERS', 2), \
+                mock.patch('posts.timelines.CELEBRITY_FOLLOWERS', 2):
+            for client in (self.authorized_client_1, self.authorized_client_2):
+                client.get(
+                    reverse('posts:profile_follow', args=['first_auth'])
+                )
+            post = Post.objects.create(
+                author=self.author_1,
+                text='Пост знаменитости',
+            )
+            self.assertFalse(TimelineEntry.objects.filter(post=post).exists())
+            self.authorized_client_1.get(
+                reverse('posts:profile_unfollow', args=['first_auth'])
+            )
+            response = self.authorized_client_2.get(
+                reverse('posts:follow_index')
+            )
+        self.assertTrue(
+            TimelineEntry.objects.filter(user=self.user_2, post=post).exists()
+        )
+        self.assertIn('pulled 0 of 1', response['Server-Timing'])
+        self.assertEqual(response.context['page_obj'][0], post)
+
+
+class DictKVStore(KVStoreBase):
+    """Хранилище sorl без базы: как redis, читается только по ключу."""
+
+    def __init__(self, data):
+        self.data = data
+
+    def _get_raw(self, key):
+        return self.data.get(key)
+
+    def _find_keys_raw(self, prefix):
+        return [key for key in self.data if key.startswith(prefix)]
+
+
+class InlineExecutor:
+    def submit(self, fn, *args):
+        future = Future()
+        try:
+            future.set_result(fn(*args))
+        except Exception as error:
+            future.set_exception(error)
+        return future
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT, IMAGE_WORKERS=0)
+class ThumbnailTest(TestCase):
+    PLACEHOLDER = 'aspect-ratio: 960 / 339'
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='auth')
+        cls.small_gif = (
+            b'\x47\x49\x46\x38\x39\x61\x02\x00'
+            b'\x01\x00\x80\x00\x00\x00\x00\x00'
+            b'\xFF\xFF\xFF\x21\xF9\x04\x00\x00'
+            b'\x00\x00\x00\x2C\x00\x00\x00\x00'
+            b'\x02\x00\x01\x00\x00\x02\x02\x0C'
+            b'\x0A\x00\x3B'
+        )
+        cls.post = Post.objects.create(
+            author=cls.author,
+            text='Пост с картинкой',
+            image=SimpleUploadedFile('small.gif', cls.small_gif),
+            moderated=True,
+        )
+        # Картинка будто бы широкая: у неё миниатюры всех ширин.
+        Post.objects.filter(pk=cls.post.pk).update(image_width=2000)
+        cls.post.refresh_from_db()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        cache.clear()
+        # В TestCase транзакция не коммитится: задачи ставятся сразу.
+        on_commit = mock.patch(
+            'posts.thumbnails.transaction.on_commit',
+            side_effect=lambda func: func(),
+        )
+        on_commit.start()
+        self.addCleanup(on_commit.stop)
+
+    def test_disabled_pool_skips_jobs(self):
+        with mock.patch('posts.workers.ProcessPoolExecutor') as pool:
+            self.assertFalse(workers.submit(print, done=print))
+            response = self.client.get(
+                reverse('posts:post_detail', kwargs={'post_id': self.post.pk})
+            )
+        pool.assert_not_called()
+        self.assertContains(response, self.PLACEHOLDER)
+
+    def test_placeholder_until_thumbnail_is_ready(self):
+        with mock.patch('posts.workers.executor') as executor:
+            self.client.get(reverse('posts:index'))
+            response = self.client.get(
+                reverse('posts:post_detail', kwargs={'post_id': self.post.pk})
+            )
+        self.assertContains(response, self.PLACEHOLDER)
+        # Вторая страница не заказывает миниатюру повторно.
+        executor.return_value.submit.assert_called_once()
+
+    def store_thumbnails(self, post):
+        """Записывает миниатюры в хранилище sorl, как процесс из пула."""
+        for width, fmt, geometry in variants():
+            thumbnail = ImageFile(
+                backend.name(
+                    post.image, geometry, format=fmt, **THUMBNAIL_OPTIONS
+                ),
+                default_storage,
+            )
+            thumbnail.set_size(tuple(map(int, geometry.split('x'))))
+            KVStore.objects.create(
+                key=add_prefix(thumbnail.key),
+                value=serialize_image_file(thumbnail),
+            )
+
+    @mock.patch('posts.thumbnails.THUMBNAIL_RETRY_DELAY', 0)
+    def test_failed_render_is_retried_soon(self):
+        name = self.post.image.name
+        with mock.patch(
+            'posts.workers.executor', return_value=InlineExecutor()
+        ), mock.patch(
+            'posts.thumbnails.render', side_effect=OSError('битый файл')
+        ), self.assertLogs('posts.thumbnails', 'ERROR'):
+            schedule(self.post)
+        self.assertIsNone(cache.get(job_key(name)))
+
+    def test_ready_thumbnail_replaces_placeholder(self):
+        url = reverse('posts:index')
+        with mock.patch('posts.workers.executor'):
+            self.assertContains(self.client.get(url), self.PLACEHOLDER)
+        cache.delete(job_key(self.post.image.name))
+        # Сама отрисовка — дело sorl-thumbnail; здесь важно, что готовая
+        # миниатюра сбрасывает закешированную страницу.
+        with mock.patch(
+            'posts.workers.executor', return_value=InlineExecutor()
+        ), mock.patch(
+            'posts.thumbnails.render',
+            side_effect=lambda *args: self.store_thumbnails(self.post),
+        ):
+            schedule(self.post)
+        response = self.client.get(url)
+        self.assertNotContains(response, self.PLACEHOLDER)
+        self.assertContains(response, 'width="960" height="339"')
+
+    def test_thumbnails_of_page_are_looked_up_at_once(self):
+        with mock.patch('posts.workers.executor'):
+            posts = [self.post] + [
+                Post.objects.create(
+                    author=self.author,
+                    text=f'Пост {i}',
+                    # Разные файлы: одинаковые картинки хранятся одним.
+                    image=SimpleUploadedFile(
+                        f'small{i}.gif', self.small_gif + bytes([i])
+                    ),
+                )
+                for i in range(3)
+            ]
+        for post in posts:
+            self.store_thumbnails(post)
+        cache.clear()
+        with CaptureQueriesContext(connection) as cold:
+            found = ready_thumbnails(posts)
+        with CaptureQueriesContext(connection) as warm:
+            ready_thumbnails(posts)
+        self.assertEqual(len(cold), 1)
+        self.assertEqual(len(warm), 0)
+        self.assertTrue(all(found[post.pk].complete for post in posts))
+
+    def test_widths_above_image_width_are_skipped(self):
+        self.assertEqual(
+            sorted({width for width, _, _ in variants(600)}), [480, 960]
+        )
+        self.assertEqual(
+            sorted({width for width, _, _ in variants(100)}), [960]
+        )
+
+    def test_unknown_thumbnail_format_is_rejected(self):
+        self.assertEqual(check_formats(['WEBP', 'JPEG']), ['WEBP', 'JPEG'])
+        for formats in (['AVIF', 'JPEG'], []):
+            with self.subTest(formats=formats):
+                with self.assertRaises(ImproperlyConfigured):
+                    check_formats(formats)
+
+    def test_other_kvstores_are_read_by_key(self):
+        self.store_thumbnails(self.post)
+        kvstore = DictKVStore(
+            dict(KVStore.objects.values_list('key', 'value'))
+        )
+        KVStore.objects.all().delete()
+        with mock.patch('posts.thumbnails.default.kvstore', kvstore):
+            thumbnail = ready_thumbnails([self.post])[self.post.pk]
+        self.assertTrue(thumbnail.complete)
+
+    def test_card_offers_every_size_and_format(self):
+        self.store_thumbnails(self.post)
+        response = self.client.get(reverse('posts:index'))
+        self.assertContains(response, '<source type="image/webp"')
+        self.assertContains(response, 'loading="lazy"')
+        for width in (480, 960, 1440):
+            with self.subTest(width=width):
+                self.assertContains(response, f' {width}w', count=2)
+
+    def test_traffic_is_counted_per_variant(self):
+        self.store_thumbnails(self.post)
+        thumbnail = ready_thumbnails([self.post])[self.post.pk]
+        small = thumbnail.files[480, 'WEBP'].url
+        lines = [
+            f'1.2.3.4 - - [18/Oct/2026:10:00:00 +0000] "GET {small} '
+            f'HTTP/1.1" 200 1000 "-" "Mozilla"',
+            f'1.2.3.4 - - [18/Oct/2026:10:00:01 +0000] "GET {small}?v=1 '
+            f'HTTP/1.1" 200 500 "-" "Mozilla"',
+            f'1.2.3.4 - - [18/Oct/2026:10:00:02 +0000] "GET {thumbnail.url} '
+            f'HTTP/1.1" 200 3000',
+            # Повторная проверка без тела и чужие адреса не считаются.
+            f'1.2.3.4 - - [18/Oct/2026:10:00:03 +0000] "GET {small} '
+            f'HTTP/1.1" 304 -',
+            '1.2.3.4 - - [18/Oct/2026:10:00:04 +0000] "GET / HTTP/1.1" '
+            '200 9000',
+        ]
+        traffic = thumbnail_traffic(lines)
+        self.assertEqual(
+            traffic,
+            {
+                (480, 'WEBP'): {'requests': 2, 'bytes': 1500},
+                (960, 'JPEG'): {'requests': 1, 'bytes': 3000},
+            },
+        )
+        kvstore = DictKVStore(
+            dict(KVStore.objects.values_list('key', 'value'))
+        )
+        with mock.patch('posts.thumbnails.default.kvstore', kvstore):
+            self.assertEqual(thumbnail_traffic(lines), traffic)
+
+    def test_new_image_is_scheduled_on_save(self):
+        with mock.patch('posts.workers.executor') as executor:
+            Post.objects.create(
+                author=self.author,
+                text='Ещё пост',
+                image=SimpleUploadedFile('other.gif', self.small_gif),
+            )
+        executor.return_value.submit.assert_called_once()
@@ -0,0 +1,330 @@
+"""Миниатюры картинок постов, нарисованные вне запроса.
+
+Каждая картинка рисуется в нескольких ширинах и форматах для srcset.
+Миниатюры рисует пул процессов: после сохранения поста с картинкой и
+при показе поста, у которого их ещё нет. Пока нет основной миниатюры,
+шаблоны показывают заглушку, а когда миниатюры готовы, сбрасываются
+теги страниц с постом.
+"""
+import collections
+import functools
+import logging
+import os
+import re
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+from sorl.thumbnail import default, get_thumbnail
+from sorl.thumbnail.base import EXTENSIONS, ThumbnailBackend
+from sorl.thumbnail.conf import defaults
+from sorl.thumbnail.conf import settings as thumbnail_settings
+from sorl.thumbnail.images import ImageFile, deserialize_image_file
+from sorl.thumbnail.kvstores.base import add_prefix
+from sorl.thumbnail.kvstores.cached_db_kvstore import (
+    KVStore as CachedDBKVStore
+)
+from sorl.thumbnail.models import KVStore
+
+from core.cache_tags import invalidate_tags
+
+from .constants import (
+    THUMBNAIL_GEOMETRY, THUMBNAIL_JOB_TIMEOUT, THUMBNAIL_OPTIONS,
+    THUMBNAIL_RETRY_DELAY, THUMBNAIL_SIZES
+)
+from .counts import follower_ids
+from .feed_cache import post_view_tags
+from .workers import submit
+
+logger = logging.getLogger(__name__)
+
+ACCESS_LOG_RE = re.compile(
+    r'"(?:GET|HEAD) (?P<path>[^ ?"]+)[^ "]* [^"]*" '
+    r'(?P<status>\d{3}) (?P<bytes>\d+|-)'
+)
+FORMATS = {f'.{extension}': fmt for fmt, extension in EXTENSIONS.items()}
+
+
+class ThumbnailNames(ThumbnailBackend):
+    def name(self, file_, geometry_string, **options):
+        """Имя файла миниатюры, как его строит get_thumbnail().
+
+        Картинка при этом не открывается и не рисуется.
+        """
+        source = ImageFile(file_)
+        if thumbnail_settings.THUMBNAIL_PRESERVE_FORMAT:
+            options.setdefault('format', self._get_format(source))
+        for key, value in self.default_options.items():
+            options.setdefault(key, value)
+        for key, attr in self.extra_options:
+            value = getattr(thumbnail_settings, attr)
+            if value != getattr(defaults, attr):
+                options.setdefault(key, value)
+        return self._get_thumbnail_filename(source, geometry_string, options)
+
+
+backend = ThumbnailNames()
+
+
+def job_key(name):
+    return f'thumbnail_job:{name}'
+
+
+def variants(image_width=None):
+    """Ширина, формат и геометрия каждой миниатюры одной картинки.
+
+    Ширины больше image_width, ширины самой картинки, пропускаются:
+    растянутая копия лишь прибавила бы байтов. Основная миниатюра
+    (THUMBNAIL_GEOMETRY) есть всегда, даже если её ширины нет в
+    THUMBNAIL_WIDTHS.
+    """
+    main_width, main_height = map(int, THUMBNAIL_GEOMETRY.split('x'))
+    widths = {
+        width for width in settings.THUMBNAIL_WIDTHS
+        if image_width is None or width <= image_width
+    }
+    for width in sorted(widths | {main_width}):
+        height = round(width * main_height / main_width)
+        for fmt in settings.THUMBNAIL_FORMATS:
+            yield width, fmt, f'{width}x{height}'
+
+
+def check_formats(formats):
+    """Форматы миниатюр, если sorl-thumbnail умеет сохранять каждый."""
+    unknown = [fmt for fmt in formats if fmt not in EXTENSIONS]
+    if unknown or not formats:
+        raise ImproperlyConfigured(
+            f'THUMBNAIL_FORMATS: неизвестные форматы {unknown}; '
+            f'допустимы {sorted(EXTENSIONS)}.'
+        )
+    return formats
+
+
+# Ошибка в настройке видна при запуске, а не в пуле на первой картинке.
+check_formats(settings.THUMBNAIL_FORMATS)
+
+
+def main_variant():
+    width = int(THUMBNAIL_GEOMETRY.split('x')[0])
+    return width, settings.THUMBNAIL_FORMATS[-1]
+
+
+class Thumbnail:
+    """Готовые миниатюры одной картинки для <picture>.
+
+    files — миниатюры по (ширина, формат); src, width и height берутся
+    у основной. image_width — ширина картинки, по которой они нарисованы.
+    """
+
+    sizes = THUMBNAIL_SIZES
+
+    def __init__(self, files, image_width=None):
+        self.files = files
+        self.main = files[main_variant()]
+        self.url = self.main.url
+        self.width = self.main.width
+        self.height = self.main.height
+        # Есть ли все миниатюры из настроек.
+        self.complete = len(files) == len(list(variants(image_width)))
+
+    def srcset_of(self, fmt):
+        return ', '.join(
+            f'{file.url} {width}w'
+            for (width, file_fmt), file in sorted(self.files.items())
+            if file_fmt == fmt
+        )
+
+    @property
+    def srcset(self):
+        return self.srcset_of(settings.THUMBNAIL_FORMATS[-1])
+
+    @property
+    def sources(self):
+        """MIME-тип и srcset для <source> каждого незапасного формата."""
+        return [
+            (f'image/{fmt.lower()}', self.srcset_of(fmt))
+            for fmt in settings.THUMBNAIL_FORMATS[:-1]
+            if self.srcset_of(fmt)
+        ]
+
+
+def render(name, image_width=None):
+    for _, fmt, geometry in variants(image_width):
+        get_thumbnail(name, geometry, format=fmt, **THUMBNAIL_OPTIONS)
+
+
+def retry_later(name):
+    """Заменяет аренду задачи короткой: повтор будет после паузы."""
+    cache.set(job_key(name), 1, THUMBNAIL_RETRY_DELAY)
+
+
+def finished(name, tags, future):
+    if future.exception() is not None:
+        logger.error(
+            'Не удалось нарисовать миниатюру %s', name,
+            exc_info=future.exception(),
+        )
+        retry_later(name)
+        return
+    cache.delete(job_key(name))
+    invalidate_tags(tags)
+
+
+def schedule_render(name, tags, image_width=None):
+    """Отдаёт миниатюры картинки name пулу, если их ещё не рисуют.
+
+    tags — теги страниц, которые сбрасываются, когда миниатюры готовы.
+    """
+    if not cache.add(job_key(name), 1, THUMBNAIL_JOB_TIMEOUT):
+        return
+    done = functools.partial(finished, name, tags)
+    if not submit(render, name, image_width, done=done):
+        # Пул занят: миниатюру закажет следующий показ поста.
+        cache.delete(job_key(name))
+
+
+def schedule(post, followers=None):
+    if followers is None:
+        followers = follower_ids(post.author_id)
+    # Теги считаются здесь: обработчик завершения не ходит в базу.
+    schedule_render(
+        post.image.name, post_view_tags(post, followers), post.image_width
+    )
+
+
+def request_thumbnail(post, followers=None):
+    """Ставит миниатюру поста в очередь после коммита транзакции."""
+    transaction.on_commit(lambda: schedule(post, followers))
+
+
+def cached_db_values(keys):
+    """Значения ключей хранилища cached_db: один get_many и один запрос.
+
+    kvstore.get() ходит в кеш и базу за каждым ключом отдельно.
+    Отсутствие значения не кешируется: его допишет в базу процесс из пула.
+    """
+    kv_cache = default.kvstore.cache
+    values = {
+        key: value for key, value in kv_cache.get_many(keys).items()
+        if isinstance(value, str)
+    }
+    missing = [key for key in keys if key not in values]
+    if missing:
+        stored = dict(
+            KVStore.objects.filter(key__in=missing).values_list('key', 'value')
+        )
+        kv_cache.set_many(stored, thumbnail_settings.THUMBNAIL_CACHE_TIMEOUT)
+        values.update(stored)
+    return values
+
+
+def raw_values(keys):
+    """Сырые значения ключей хранилища sorl; отсутствующих нет в ответе.
+
+    Хранилище cached_db читается пачкой, остальные — по ключу, как это
+    делает сам sorl.
+    """
+    kvstore = default.kvstore
+    if isinstance(kvstore, CachedDBKVStore):
+        return cached_db_values(keys)
+    values = {key: kvstore._get_raw(key) for key in keys}
+    return {key: value for key, value in values.items() if value is not None}
+
+
+def stored_thumbnails(names):
+    """Готовые миниатюры по именам файлов."""
+    keys = {
+        add_prefix(ImageFile(name, default.storage).key): name
+        for name in names
+    }
+    return {
+        keys[key]: deserialize_image_file(value)
+        for key, value in raw_values(list(keys)).items()
+    }
+
+
+def ready_thumbnails(posts, followers=None):
+    """Готовые миниатюры картинок постов по id; недостающие заказывает.
+
+    Все миниатюры всех постов ищутся одним stored_thumbnails(). Пост без
+    основной миниатюры получает None.
+    """
+    names = {
+        (post.pk, width, fmt): backend.name(
+            post.image, geometry, format=fmt, **THUMBNAIL_OPTIONS
+        )
+        for post in posts if post.image
+        for width, fmt, geometry in variants(post.image_width)
+    }
+    stored = stored_thumbnails(set(names.values())) if names else {}
+    files = collections.defaultdict(dict)
+    for (pk, width, fmt), name in names.items():
+        if name in stored:
+            files[pk][width, fmt] = stored[name]
+    thumbnails = {}
+    for post in posts:
+        found = files.get(post.pk, {})
+        thumbnails[post.pk] = (
+            Thumbnail(found, post.image_width)
+            if main_variant() in found else None
+        )
+        if post.image and not (
+            thumbnails[post.pk] and thumbnails[post.pk].complete
+        ):
+            request_thumbnail(post, followers)
+    return thumbnails
+
+
+def ready_thumbnail(post, followers=None):
+    """Миниатюры картинки поста, если основная готова; иначе заказывает их."""
+    return ready_thumbnails([post], followers)[post.pk]
+
+
+def stored_images():
+    """Сериализованные картинки хранилища sorl: исходники и миниатюры."""
+    kvstore = default.kvstore
+    if isinstance(kvstore, CachedDBKVStore):
+        marker = f'"name": "{thumbnail_settings.THUMBNAIL_PREFIX}'
+        return KVStore.objects.filter(
+            key__startswith=add_prefix(''), value__contains=marker
+        ).values_list('value', flat=True).iterator()
+    return (
+        value for value in map(
+            kvstore._get_raw, kvstore._find_keys_raw(add_prefix(''))
+        )
+        if value is not None
+    )
+
+
+def thumbnail_variants():
+    """Ширина и формат каждой нарисованной миниатюры по её адресу."""
+    found = {}
+    for value in stored_images():
+        thumbnail = deserialize_image_file(value)
+        if not thumbnail.name.startswith(thumbnail_settings.THUMBNAIL_PREFIX):
+            continue
+        extension = os.path.splitext(thumbnail.name)[1]
+        found[thumbnail.url] = (
+            thumbnail.width, FORMATS.get(extension, extension)
+        )
+    return found
+
+
+def thumbnail_traffic(lines):
+    """Запросы и байты по вариантам миниатюр из журнала веб-сервера.
+
+    Строки журнала — в формате common или combined (nginx, Apache).
+    Учитываются ответы с телом, отданные по адресам миниатюр.
+    """
+    variants_by_url = thumbnail_variants()
+    traffic = collections.defaultdict(collections.Counter)
+    for line in lines:
+        match = ACCESS_LOG_RE.search(line)
+        if match is None or match['status'] not in ('200', '206'):
+            continue
+        variant = variants_by_url.get(match['path'])
+        if variant is not None:
+            traffic[variant]['requests'] += 1
+            traffic[variant]['bytes'] += int(match['bytes'].strip('-') or 0)
+    return traffic
@@ -0,0 +1,364 @@
+import collections
+import heapq
+import itertools
+import time
+
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import OuterRef, Q, Subquery
+
+from core.cache_tags import invalidate_tags
+
+from .constants import (
+    CELEBRITY_FOLLOWERS, KWAY_MERGE_MIN_FOLLOWING, PAGE_MODE_MAX_POSTS,
+    POSTS_COUNT, RECENT_POSTS_PER_AUTHOR, RECENT_POSTS_TTL,
+    TIMELINE_BACKFILL_POSTS, TIMELINE_BATCH_SIZE
+)
+from .counts import (
+    FEED_FOLLOW, bump_follow_counters, count_key, feed_count,
+    followers_counts, invalidate_follow_counts, is_celebrity
+)
+from .feed_cache import follow_feed_tags, follow_tags_of
+from .hydration import feed_page, hydrate
+from .models import Follow, Post, TimelineEntry
+from .utils import (
+    CURSOR_NEXT, CursorPage, cursor_decode, keyset_filter, paginator_create
+)
+
+
+def timeline_entry(user_id, post):
+    return TimelineEntry(
+        user_id=user_id,
+        post_id=post.pk,
+        author_id=post.author_id,
+        pub_date=post.pub_date,
+    )
+
+
+def fan_out_post(post):
+    """Раскладывает новый пост по лентам подписчиков автора.
+
+    Посты знаменитостей не раскладываются: их подмешивает follow_feed.
+    """
+    if is_celebrity(post.author_id):
+        return
+    followers = Follow.objects.filter(
+        author_id=post.author_id
+    ).values_list('user_id', flat=True).iterator()
+    entries = []
+    for user_id in followers:
+        entries.append(timeline_entry(user_id, post))
+        if len(entries) == TIMELINE_BATCH_SIZE:
+            TimelineEntry.objects.bulk_create(entries, ignore_conflicts=True)
+            entries = []
+    TimelineEntry.objects.bulk_create(entries, ignore_conflicts=True)
+
+
+def backfill_timeline(user, author):
+    """Добавляет в ленту подписчика последние посты автора."""
+    if is_celebrity(author.pk):
+        return
+    posts = author.posts.order_by('-pub_date')[:TIMELINE_BACKFILL_POSTS]
+    TimelineEntry.objects.bulk_create(
+        [timeline_entry(user.pk, post) for post in posts],
+        ignore_conflicts=True,
+    )
+
+
+def backfill_followers(author):
+    """Добавляет последние посты автора в ленты всех его подписчиков.
+
+    Пока автор был знаменитостью, его посты не раскладывались, а новые
+    подписчики не получали их при подписке. Когда подписчиков становится
+    меньше порога, лента читает автора только из timeline.
+    """
+    posts = list(author.posts.order_by('-pub_date')[:TIMELINE_BACKFILL_POSTS])
+    followers = list(
+        Follow.objects.filter(author=author).values_list('user_id', flat=True)
+    )
+    entries = []
+    for user_id in followers:
+        entries += [timeline_entry(user_id, post) for post in posts]
+        if len(entries) >= TIMELINE_BATCH_SIZE:
+            TimelineEntry.objects.bulk_create(entries, ignore_conflicts=True)
+            entries = []
+    TimelineEntry.objects.bulk_create(entries, ignore_conflicts=True)
+    cache.delete_many([count_key(FEED_FOLLOW, pk) for pk in followers])
+
+
+def prune_timeline(user, author):
+    TimelineEntry.objects.filter(user=user, author=author).delete()
+
+
+def insert_follow(user_id, author_id):
+    """Добавляет подписку; False, если она уже есть.
+
+    bulk_create не отправляет сигналы, а повтор ловится уникальным
+    ограничением внутри точки сохранения.
+    """
+    try:
+        with transaction.atomic():
+            Follow.objects.bulk_create(
+                [Follow(user_id=user_id, author_id=author_id)]
+            )
+    except IntegrityError:
+        return False
+    return True
+
+
+def follow_author(user, author):
+    """Подписка одним INSERT, повторный запрос ничего не меняет.
+
+    Сигналы при этом не отправляются, поэтому счётчики и лента
+    обновляются здесь же.
+    """
+    with transaction.atomic():
+        if insert_follow(user.pk, author.pk):
+            bump_follow_counters(user.pk, author.pk, 1)
+    invalidate_follow_counts(user.pk, author.pk)
+    backfill_timeline(user, author)
+    invalidate_tags(follow_tags_of(user.pk, author.pk))
+
+
+def unfollow_author(user, author):
+    """Отписка одним DELETE: у Follow нет обработчиков удаления.
+
+    Если автор при этом перестал быть знаменитостью, его посты
+    раскладываются по лентам оставшихся подписчиков.
+    """
+    was_celebrity = is_celebrity(author.pk)
+    with transaction.atomic():
+        deleted, _ = Follow.objects.filter(user=user, author=author).delete()
+        if deleted:
+            bump_follow_counters(user.pk, author.pk, -deleted)
+    invalidate_follow_counts(user.pk, author.pk)
+    prune_timeline(user, author)
+    if was_celebrity and not is_celebrity(author.pk):
+        backfill_followers(author)
+    invalidate_tags(follow_tags_of(user.pk, author.pk))
+
+
+def recent_key(author_id):
+    return f'recent_posts:{author_id}'
+
+
+def load_recent_posts(author_ids):
+    """Последние посты каждого из авторов одним запросом.
+
+    Подзапрос выбирает верхние RECENT_POSTS_PER_AUTHOR постов автора по
+    индексу (author, -pub_date, -id), а по авторам строки раскладываются
+    уже здесь.
+    """
+    newest = Post.objects.filter(
+        author_id=OuterRef('author_id')
+    ).order_by('-pub_date', '-pk').values('pk')[:RECENT_POSTS_PER_AUTHOR]
+    rows = Post.objects.filter(
+        author_id__in=author_ids, pk__in=Subquery(newest)
+    ).order_by('author_id', '-pub_date', '-pk').values_list(
+        'author_id', 'pub_date', 'pk'
+    )
+    streams = {pk: [] for pk in author_ids}
+    for author_id, pub_date, pk in rows:
+        streams[author_id].append((pub_date, pk))
+    return streams
+
+
+def recent_posts(author_ids):
+    """Последние посты авторов как списки (pub_date, id) по убыванию.
+
+    Списки живут в кеше и годятся как для ленты подписок, так и для
+    первой страницы профиля.
+    """
+    keys = {recent_key(pk): pk for pk in author_ids}
+    streams = {keys[key]: value for key, value in cache.get_many(keys).items()}
+    missing = [pk for pk in author_ids if pk not in streams]
+    if missing:
+        fresh = load_recent_posts(missing)
+        cache.set_many(
+            {recent_key(pk): value for pk, value in fresh.items()},
+            RECENT_POSTS_TTL,
+        )
+        streams.update(fresh)
+    return streams
+
+
+def invalidate_recent_posts(post):
+    cache.delete(recent_key(post.author_id))
+
+
+def timeline_stream(user, position):
+    """Записи timeline за курсором как список (pub_date, post_id)."""
+    entries = TimelineEntry.objects.filter(user=user)
+    if position is not None:
+        entries = entries.filter(keyset_filter(*position, 'post_id'))
+    if position is None or position[0] == CURSOR_NEXT:
+        entries = entries.order_by('-pub_date', '-post_id')
+        return list(
+            entries.values_list('pub_date', 'post_id')[:POSTS_COUNT + 1]
+        )
+    entries = entries.order_by('pub_date', 'post_id')
+    return list(
+        entries.values_list('pub_date', 'post_id')[:POSTS_COUNT + 1]
+    )[::-1]
+
+
+def cached_floor(streams):
+    """Самый свежий из последних элементов обрезанных списков: ниже него
+    у какого-то автора могут быть посты, которых нет в кеше."""
+    return max(
+        (stream[-1] for stream in streams
+         if len(stream) == RECENT_POSTS_PER_AUTHOR),
+        default=None,
+    )
+
+
+def merge_keys(timeline, streams):
+    """Слияние отрезка timeline со списками авторов по убыванию.
+
+    Пост автора, ставшего знаменитостью, может быть и в timeline, и в его
+    списке: одинаковые ключи идут подряд и отбрасываются.
+    """
+    merged = heapq.merge(timeline, *streams, reverse=True)
+    return (key for key, _ in itertools.groupby(merged))
+
+
+def merged_page(streams, position, timeline=()):
+    """Страница ленты слиянием k отсортированных списков (pub_date, id).
+
+    streams — закешированные списки последних постов авторов, timeline —
+    уже прочитанный отрезок ленты за курсором. Полные строки Post читаются
+    только для постов, попавших на страницу. Если страница уходит глубже
+    закешированных списков, возвращает None, и ленту нужно строить
+    запросом к базе.
+    """
+    floor = cached_floor(streams)
+    merged = merge_keys(timeline, streams)
+    if position is None or position[0] == CURSOR_NEXT:
+        if position is not None:
+            mark = position[1:]
+            merged = itertools.dropwhile(lambda key: key >= mark, merged)
+        keys = list(itertools.islice(merged, POSTS_COUNT + 1))
+        if floor is not None and (
+            len(keys) <= POSTS_COUNT or keys[POSTS_COUNT - 1] < floor
+        ):
+            return None
+        has_next = len(keys) > POSTS_COUNT
+        has_previous = position is not None
+        keys = keys[:POSTS_COUNT]
+    else:
+        mark = position[1:]
+        if floor is not None and mark < floor:
+            return None
+        keys = list(collections.deque(
+            itertools.takewhile(lambda key: key > mark, merged),
+            maxlen=POSTS_COUNT + 1,
+        ))
+        has_next = True
+        has_previous = len(keys) > POSTS_COUNT
+        keys = keys[-POSTS_COUNT:]
+    return CursorPage(
+        hydrate([pk for _, pk in keys]), has_next, has_previous
+    )
+
+
+def timeline_page(user, pulled, number, count):
+    """Страница ленты по номеру: отрезок timeline по индексу
+    (user, -pub_date, -post), слитый со списками знаменитостей.
+
+    count — размер ленты из feed_count. Если страница уходит глубже
+    закешированных списков, возвращает None.
+    """
+    entries = TimelineEntry.objects.filter(user=user).order_by(
+        '-pub_date', '-post_id'
+    ).values_list('pub_date', 'post_id')
+    page = paginator_create(entries, number, count)
+    if pulled:
+        streams = list(recent_posts(pulled).values())
+        bottom = (page.number - 1) * POSTS_COUNT
+        keys = list(itertools.islice(
+            merge_keys(entries[:bottom + POSTS_COUNT], streams),
+            bottom,
+            bottom + POSTS_COUNT,
+        ))
+        floor = cached_floor(streams)
+        if floor is not None and (
+            len(keys) < POSTS_COUNT or keys[-1] < floor
+        ):
+            return None
+    else:
+        keys = list(page.object_list)
+    page.object_list = hydrate([pk for _, pk in keys])
+    return page
+
+
+def follow_feed(user, pulled):
+    """Лента подписок одним запросом: timeline плюс посты знаменитостей."""
+    pushed = TimelineEntry.objects.filter(user=user).values('post_id')
+    return Post.objects.filter(Q(pk__in=pushed) | Q(author_id__in=pulled))
+
+
+def following_authors(user):
+    """Авторы в подписках и те из них, чьи посты подмешиваются при чтении."""
+    author_ids = list(
+        Follow.objects.filter(user=user).values_list('author_id', flat=True)
+    )
+    counts = followers_counts(author_ids)
+    pulled = [pk for pk in author_ids if counts[pk] >= CELEBRITY_FOLLOWERS]
+    return author_ids, pulled
+
+
+def follow_page(user, request):
+    """Страница ленты подписок, подмешанные авторы и статистика.
+
+    Тем, кто подписан на множество авторов, страница собирается слиянием
+    списков последних постов всех авторов. Остальным — слиянием отрезка
+    timeline со списками знаменитостей: по курсору для больших лент и по
+    номерам страниц для небольших. Запрос follow_feed остаётся на случай,
+    когда страница глубже закешированных списков.
+    """
+    started = time.perf_counter()
+    cursor = request.GET.get('cursor')
+    position = cursor_decode(cursor) if cursor else None
+    author_ids, pulled = following_authors(user)
+    stats = {
+        'threshold': CELEBRITY_FOLLOWERS,
+        'following': len(author_ids),
+        'pulled': len(pulled),
+        'plan_ms': (time.perf_counter() - started) * 1000,
+    }
+    post_list = follow_feed(user, pulled)
+    page_obj = None
+    if len(author_ids) >= KWAY_MERGE_MIN_FOLLOWING:
+        stats['strategy'] = 'kway'
+        page_obj = merged_page(
+            list(recent_posts(author_ids).values()), position
+        )
+    elif (
+        cursor is not None
+        or feed_count(FEED_FOLLOW, user.pk, post_list) > PAGE_MODE_MAX_POSTS
+    ):
+        stats['strategy'] = 'timeline'
+        page_obj = merged_page(
+            list(recent_posts(pulled).values()),
+            position,
+            timeline_stream(user, position),
+        )
+    else:
+        stats['strategy'] = 'pages'
+        page_obj = timeline_page(
+            user,
+            pulled,
+            request.GET.get('page'),
+            feed_count(FEED_FOLLOW, user.pk, post_list),
+        )
+    if page_obj is None:
+        stats['strategy'] = 'query'
+        count = feed_count(FEED_FOLLOW, user.pk, post_list)
+        page_obj = feed_page(
+            post_list, request, count, follow_feed_tags(user.pk, pulled)
+        )
+    len(page_obj)
+    stats['merge_ms'] = (
+        (time.perf_counter() - started) * 1000 - stats['plan_ms']
+    )
+    return page_obj, pulled, stats
@@ -0,0 +1,341 @@
+"""Загрузка картинок постов.
+
+Размеры, объём и хеш картинки считаются один раз при загрузке: файл
+читается кусками, а Pillow разбирает только заголовок. Одинаковые
+картинки хранятся одним файлом в каталоге по началу хеша. После
+сохранения пул процессов уменьшает и перекодирует картинку.
+"""
+import functools
+import hashlib
+import io
+import logging
+import os
+import re
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from PIL import Image, ImageOps
+
+from .constants import (
+    IMAGE_JPEG_QUALITY, IMAGE_WEBP_QUALITY, NORMALIZED_FORMATS,
+    SHARD_BATCH_SIZE, THUMBNAIL_JOB_TIMEOUT, UPLOAD_CHUNK_SIZE
+)
+from .feed_cache import post_view_tags, refresh_posts
+from .models import Post
+from .thumbnails import job_key, retry_later, schedule_render
+from .workers import submit
+
+logger = logging.getLogger(__name__)
+
+IMAGE_FIELDS = ('image_width', 'image_height', 'image_size', 'image_hash')
+# Сведения о картинке вместе с тем, какой её загрузили до перекодирования.
+UPLOAD_FIELDS = IMAGE_FIELDS + ('image_original_size', 'image_original_hash')
+SHARDED_PATTERN = r'^posts/[0-9a-f]{2}/[0-9a-f]{2}/'
+SHARDED_RE = re.compile(SHARDED_PATTERN)
+EXIF_ORIENTATION = 0x0112
+JPEG_SOS = 0xDA
+# Сегменты APP1 (EXIF, XMP) и APP13 (IPTC).
+JPEG_METADATA_MARKERS = (0xE1, 0xED)
+
+
+def image_metadata(file):
+    """Ширина, высота, размер в байтах и SHA-256 загруженного файла."""
+    digest = hashlib.sha256()
+    size = 0
+    file.seek(0)
+    for chunk in file.chunks(UPLOAD_CHUNK_SIZE):
+        digest.update(chunk)
+        size += len(chunk)
+    file.seek(0)
+    with Image.open(file) as image:
+        width, height = image.size
+    file.seek(0)
+    return width, height, size, digest.hexdigest()
+
+
+def shard_name(digest, filename):
+    """Имя картинки в каталоге ab/cd, где abcd — начало её SHA-256.
+
+    Загрузки расходятся по 65536 каталогам внутри upload_to вместо
+    одного.
+    """
+    return f'{digest[:2]}/{digest[2:4]}/{os.path.basename(filename)}'
+
+
+def sharded_image_path(digest, filename):
+    field = Post._meta.get_field('image')
+    return field.generate_filename(None, shard_name(digest, filename))
+
+
+def stored_image(digest):
+    return Post.objects.filter(
+        image_hash=digest
+    ).values_list('image', flat=True).first()
+
+
+def stored_upload(digest):
+    """Картинка, уже загруженная с хешем digest, и сведения о ней.
+
+    Перекодированная картинка находится по хешу исходного файла.
+    """
+    return Post.objects.filter(
+        Q(image_hash=digest) | Q(image_original_hash=digest)
+    ).values('image', *UPLOAD_FIELDS).first()
+
+
+def attach_upload(post):
+    """Записывает в пост сведения о только что загруженной картинке.
+
+    Если такая картинка уже хранится, пост ссылается на её файл, и новый
+    не сохраняется.
+    """
+    post._uploaded = False
+    if not post.image:
+        post.image_width = post.image_height = post.image_size = None
+        post.image_original_size = None
+        post.image_hash = post.image_original_hash = ''
+        return
+    if post.image._committed:
+        return
+    metadata = image_metadata(post.image.file)
+    for name, value in zip(IMAGE_FIELDS, metadata):
+        setattr(post, name, value)
+    post.image_original_size = None
+    post.image_original_hash = ''
+    stored = stored_upload(post.image_hash)
+    if stored:
+        # Пост получает файл и сведения картинки, возможно, уже
+        # перекодированной.
+        for name, value in stored.items():
+            setattr(post, name, value)
+    else:
+        post.image.name = shard_name(post.image_hash, post.image.name)
+        # Новый файл после сохранения перекодирует пул: normalize_upload().
+        post._uploaded = True
+
+
+def stripped_jpeg(data):
+    """JPEG без сегментов EXIF, XMP и IPTC; сжатые данные не меняются."""
+    parts = [data[:2]]
+    pos = 2
+    while pos + 4 <= len(data) and data[pos] == 0xFF:
+        marker = data[pos + 1]
+        if marker == 0xFF:
+            # Заполняющий байт перед маркером.
+            pos += 1
+            continue
+        if marker == JPEG_SOS:
+            break
+        end = pos + 2 + int.from_bytes(data[pos + 2:pos + 4], 'big')
+        if marker not in JPEG_METADATA_MARKERS:
+            parts.append(data[pos:end])
+        pos = end
+    parts.append(data[pos:])
+    return b''.join(parts)
+
+
+def encoded(image, fmt, **options):
+    buffer = io.BytesIO()
+    image.save(buffer, fmt, **options)
+    return buffer.getvalue()
+
+
+def lossy_copy(image):
+    """Прозрачная картинка в WebP, остальные — в прогрессивном JPEG."""
+    if image.mode in ('RGBA', 'LA', 'PA') or 'transparency' in image.info:
+        return (
+            encoded(image, 'WEBP', quality=IMAGE_WEBP_QUALITY, method=6),
+            'webp',
+        )
+    return (
+        encoded(
+            image.convert('RGB'), 'JPEG', quality=IMAGE_JPEG_QUALITY,
+            optimize=True, progressive=True,
+        ),
+        'jpg',
+    )
+
+
+def lossless_copy(source, image, data):
+    """Копия без метаданных и без потери качества или None.
+
+    PNG пересохраняется целиком. У JPEG вырезаются сегменты метаданных,
+    если картинку не нужно ни поворачивать, ни уменьшать.
+    """
+    if source.format == 'PNG':
+        return encoded(image, 'PNG', optimize=True), 'png'
+    if (
+        source.format == 'JPEG'
+        and source.getexif().get(EXIF_ORIENTATION, 1) == 1
+        and image.size == source.size
+    ):
+        return stripped_jpeg(data), 'jpg'
+    return None
+
+
+def normalized_image(file):
+    """Картинка для хранения: байты, расширение, ширина и высота.
+
+    Картинка поворачивается по EXIF, уменьшается до IMAGE_MAX_SIDE по
+    большей стороне и всегда теряет EXIF. Из перекодированной копии и
+    копии без потерь хранится меньшая. None — если формат не
+    перекодируется или в файле нечего менять.
+    """
+    data = file.read()
+    with Image.open(io.BytesIO(data)) as source:
+        if source.format not in NORMALIZED_FORMATS:
+            return None
+        image = ImageOps.exif_transpose(source)
+        image.thumbnail((settings.IMAGE_MAX_SIDE, settings.IMAGE_MAX_SIDE))
+        copies = [lossless_copy(source, image, data), lossy_copy(image)]
+    content, extension = min(
+        filter(None, copies), key=lambda copy: len(copy[0])
+    )
+    if content == data:
+        return None
+    return content, extension, image.width, image.height
+
+
+def normalize(name):
+    """Задача пула: заменяет загруженную картинку name перекодированной.
+
+    Возвращает новое имя и ширину картинки или None, если она осталась
+    прежней.
+    """
+    storage = Post._meta.get_field('image').storage
+    with storage.open(name) as file:
+        normalized = normalized_image(file)
+    if normalized is None:
+        return None
+    data, extension, width, height = normalized
+    digest = hashlib.sha256(data).hexdigest()
+    new_name = stored_image(digest)
+    if new_name is None:
+        stem = os.path.splitext(os.path.basename(name))[0]
+        new_name = storage.save(
+            sharded_image_path(digest, f'{stem}.{extension}'),
+            ContentFile(data),
+        )
+    Post.objects.filter(image=name).update(
+        image=new_name,
+        image_width=width,
+        image_height=height,
+        image_original_size=F('image_size'),
+        image_original_hash=F('image_hash'),
+        image_size=len(data),
+        image_hash=digest,
+        updated=timezone.now(),
+    )
+    if not Post.objects.filter(image=name).exists():
+        storage.delete(name)
+    logger.info(
+        'Картинка %s перекодирована в %s: %d байт', name, new_name, len(data)
+    )
+    return new_name, width
+
+
+def normalized(name, width, pks, tags, future):
+    if future.exception() is not None:
+        # После паузы показ поста закажет миниатюру исходной картинки.
+        logger.error(
+            'Не удалось перекодировать картинку %s', name,
+            exc_info=future.exception(),
+        )
+        retry_later(name)
+        return
+    result = future.result()
+    cache.delete(job_key(name))
+    if result is not None:
+        refresh_posts(Post.objects.filter(pk__in=pks))
+        name, width = result
+    schedule_render(name, tags, width)
+
+
+def schedule_normalization(post, followers):
+    name = post.image.name
+    # Аренда миниатюры не даёт показам поста рисовать её по исходнику,
+    # который вот-вот заменится.
+    if not cache.add(job_key(name), 1, THUMBNAIL_JOB_TIMEOUT):
+        return
+    pks = list(Post.objects.filter(image=name).values_list('pk', flat=True))
+    done = functools.partial(
+        normalized, name, post.image_width, pks,
+        post_view_tags(post, followers),
+    )
+    if not submit(normalize, name, done=done):
+        logger.warning('Очередь картинок полна, %s не перекодирована', name)
+        cache.delete(job_key(name))
+
+
+def normalize_upload(post, followers):
+    """Ставит новую картинку поста в очередь на перекодирование.
+
+    Пока она в очереди, показывается заглушка; миниатюра рисуется уже
+    по перекодированной картинке.
+    """
+    transaction.on_commit(lambda: schedule_normalization(post, followers))
+
+
+def unsharded_images():
+    return Post.objects.exclude(image='').exclude(image__isnull=True).exclude(
+        image__regex=SHARDED_PATTERN
+    )
+
+
+def move_image(name):
+    """Переносит файл name в каталог по хешу и переписывает ссылки на него.
+
+    Возвращает False, если файла нет или это не картинка.
+    """
+    storage = Post._meta.get_field('image').storage
+    if not storage.exists(name):
+        return False
+    try:
+        with storage.open(name) as file:
+            metadata = image_metadata(file)
+            # Такая же картинка могла уже переехать с другим именем.
+            new_name = stored_image(metadata[-1])
+            if new_name is None or not SHARDED_RE.match(new_name):
+                new_name = storage.save(
+                    sharded_image_path(metadata[-1], name), file
+                )
+    except OSError:
+        return False
+    pks = list(Post.objects.filter(image=name).values_list('pk', flat=True))
+    Post.objects.filter(pk__in=pks, image=name).update(
+        image=new_name,
+        updated=timezone.now(),
+        **dict(zip(IMAGE_FIELDS, metadata)),
+    )
+    refresh_posts(Post.objects.filter(pk__in=pks))
+    storage.delete(name)
+    return True
+
+
+def shard_images(batch_size=SHARD_BATCH_SIZE):
+    """Переносит картинки в каталоги по хешу, отдавая итоги пачек.
+
+    Каждая пачка — короткие UPDATE по отдельным файлам, так что таблица
+    постов не блокируется надолго. Прерванный перенос запускается
+    заново: перенесённые картинки под выборку уже не попадают.
+    """
+    last_pk = 0
+    while True:
+        batch = list(
+            unsharded_images().filter(pk__gt=last_pk).order_by('pk')
+            .values_list('pk', 'image')[:batch_size]
+        )
+        if not batch:
+            return
+        last_pk = batch[-1][0]
+        moved = skipped = 0
+        for name in dict.fromkeys(name for _, name in batch):
+            if move_image(name):
+                moved += 1
+            else:
+                skipped += 1
+        yield moved, skipped
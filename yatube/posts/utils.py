@@ -1,8 +1,158 @@
+import base64
+import binascii
+
 from django.core.paginator import Paginator
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+from core.page_cache import page_position
 
-from .constants import POSTS_COUNT
+from .constants import POSTS_COUNT, PAGE_MODE_MAX_POSTS
 
+CURSOR_NEXT = 'n'
+CURSOR_PREV = 'p'
 
-def paginator_create(post_list, page_number):
+
+def paginator_create(post_list, page_number, count=None):
     paginator = Paginator(post_list, POSTS_COUNT)
+    if count is not None:
+        # Число строк уже известно из кеша: COUNT(*) не нужен.
+        paginator.count = count
     return paginator.get_page(page_number)
+
+
+def cursor_encode(direction, obj, date_field='pub_date'):
+    """Упаковывает позицию (дата, id) объекта в непрозрачный токен."""
+    raw = f'{direction}|{getattr(obj, date_field).isoformat()}|{obj.pk}'
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def cursor_decode(token):
+    """Распаковывает токен; на испорченный токен возвращает None."""
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        raw = base64.urlsafe_b64decode(padded.encode()).decode()
+        direction, pub_date, pk = raw.split('|')
+        pub_date = parse_datetime(pub_date)
+        pk = int(pk)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        return None
+    if direction not in (CURSOR_NEXT, CURSOR_PREV) or pub_date is None:
+        return None
+    return direction, pub_date, pk
+
+
+def feed_position(request):
+    """Номер страницы и курсор ленты для ключей кеша.
+
+    None — если хоть один из них испорчен: такую ленту не кешируют.
+    """
+    position = page_position(request)
+    if position is None:
+        return None
+    cursor = position[1]
+    if cursor and cursor_decode(cursor) is None:
+        return None
+    return position
+
+
+class CursorPage:
+    """Страница ленты, полученная по ключу (дата, id) без OFFSET."""
+
+    is_cursor = True
+
+    def __init__(self, object_list, has_next, has_previous,
+                 date_field='pub_date'):
+        self.object_list = object_list
+        self._has_next = has_next
+        self._has_previous = has_previous
+        self.date_field = date_field
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_other_pages(self):
+        return self._has_next or self._has_previous
+
+    def next_cursor(self):
+        if self._has_next and self.object_list:
+            return cursor_encode(
+                CURSOR_NEXT, self.object_list[-1], self.date_field
+            )
+        return None
+
+    def previous_cursor(self):
+        if self._has_previous and self.object_list:
+            return cursor_encode(
+                CURSOR_PREV, self.object_list[0], self.date_field
+            )
+        return None
+
+
+def keyset_filter(direction, date, pk, pk_field='pk', date_field='pub_date'):
+    # Условие на дату вынесено отдельно, чтобы СУБД взяла диапазон
+    # по индексу, а не объединяла два поиска через OR.
+    if direction == CURSOR_NEXT:
+        return Q(**{f'{date_field}__lte': date}) & (
+            Q(**{f'{date_field}__lt': date}) | Q(**{f'{pk_field}__lt': pk})
+        )
+    return Q(**{f'{date_field}__gte': date}) & (
+        Q(**{f'{date_field}__gt': date}) | Q(**{f'{pk_field}__gt': pk})
+    )
+
+
+def cursor_paginator_create(object_list, cursor, per_page=POSTS_COUNT,
+                            date_field='pub_date'):
+    position = cursor_decode(cursor) if cursor else None
+    newest_first = (f'-{date_field}', '-pk')
+    if position is None:
+        objects = list(object_list.order_by(*newest_first)[:per_page + 1])
+        return CursorPage(
+            objects[:per_page], len(objects) > per_page, False, date_field
+        )
+    direction, date, pk = position
+    object_list = object_list.filter(
+        keyset_filter(direction, date, pk, date_field=date_field)
+    )
+    if direction == CURSOR_NEXT:
+        objects = list(object_list.order_by(*newest_first)[:per_page + 1])
+        return CursorPage(
+            objects[:per_page], len(objects) > per_page, True, date_field
+        )
+    objects = list(object_list.order_by(date_field, 'pk')[:per_page + 1])
+    has_previous = len(objects) > per_page
+    return CursorPage(
+        objects[:per_page][::-1], True, has_previous, date_field
+    )
+
+
+def uses_cursor(post_list, request, count=None):
+    """Большие ленты и запросы с курсором листаются по курсору."""
+    if request.GET.get('cursor') is not None:
+        return True
+    if count is None:
+        count = post_list[:PAGE_MODE_MAX_POSTS + 1].count()
+    return count > PAGE_MODE_MAX_POSTS
+
+
+def page_create(post_list, request, count=None):
+    """Выбирает режим пагинации ленты.
+
+    Небольшие ленты листаются по номерам страниц, большие — по курсору,
+    чтобы не выполнять COUNT(*) и OFFSET на глубоких страницах.
+    """
+    if uses_cursor(post_list, request, count):
+        return cursor_paginator_create(post_list, request.GET.get('cursor'))
+    return paginator_create(post_list, request.GET.get('page'), count)
@@ -1,45 +1,82 @@
+import logging
+
 from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib.auth.decorators import login_required
+from django.db import transaction
+
+from core.cache_tags import tag
+from core.conditional import conditional_page
+from core.page_cache import page_tags, public_page
 
+from . import conditional
+from .constants import COMMENTS_COUNT
 from .models import Post, Group, User, Follow
 from .forms import PostForm, CommentForm
-from .utils import paginator_create
+from .hydration import feed_page
+from .counts import FEED_AUTHOR, FEED_GROUP, FEED_INDEX, feed_count
+from .feed_cache import feed_cache, follow_feed_tags, post_page_tags
+from .timelines import follow_author, follow_page, unfollow_author
+from .utils import cursor_paginator_create
 
+logger = logging.getLogger(__name__)
 
+
+@conditional_page(conditional.index_tags)
+@public_page
 def index(request):
     post_list = Post.objects.select_related('author', 'group')
+    count = feed_count(FEED_INDEX, None, post_list)
     context = {
-        'page_obj': paginator_create(post_list, request.GET.get('page')),
+        'page_obj': feed_page(post_list, request, count, [tag(FEED_INDEX)]),
+        **feed_cache(request, tag(FEED_INDEX)),
     }
     return render(request, 'posts/index.html', context)
 
 
+@conditional_page(conditional.group_tags)
+@public_page
 def group_posts(request, slug):
     group = get_object_or_404(Group, slug=slug)
     post_list = group.posts.all()
+    count = feed_count(FEED_GROUP, group.pk, post_list)
     context = {
         'group': group,
-        'page_obj': paginator_create(post_list, request.GET.get('page')),
+        'page_obj': feed_page(
+            post_list, request, count, [tag(FEED_GROUP, group.pk)]
+        ),
+        **feed_cache(request, tag(FEED_GROUP, group.pk)),
     }
     return render(request, 'posts/group_list.html', context)
 
 
+@conditional_page(conditional.profile_tags)
+@public_page(anonymous_only=True)
 def profile(request, username):
-    author = get_object_or_404(User, username=username)
+    author = get_object_or_404(
+        User.objects.select_related('stats'), username=username
+    )
     post_list = author.posts.all()
+    count = feed_count(FEED_AUTHOR, author.pk, post_list)
     user = request.user
     following = user.is_authenticated and Follow.objects.filter(
         user=user, author=author).exists()
     context = {
         'author': author,
-        'page_obj': paginator_create(post_list, request.GET.get('page')),
+        'page_obj': feed_page(
+            post_list, request, count, [tag(FEED_AUTHOR, author.pk)]
+        ),
         'following': following,
+        **feed_cache(request, tag(FEED_AUTHOR, author.pk)),
     }
     return render(request, 'posts/profile.html', context)
 
 
+@conditional_page(conditional.post_detail_tags)
+@public_page(anonymous_only=True)
 def post_detail(request, post_id):
-    post = get_object_or_404(Post, pk=post_id)
+    post = get_object_or_404(
+        Post.objects.select_related('author__stats', 'group'), pk=post_id
+    )
     form = CommentForm(request.POST or None)
     user = request.user
     if form.is_valid():
@@ -50,7 +87,13 @@ def post_detail(request, post_id):
         return redirect('posts/post_detail.html', pk=post_id)
     else:
         context = {'form': form}
-        comments = post.comments.all()
+        comments = cursor_paginator_create(
+            post.comments.select_related('author'),
+            None,
+            per_page=COMMENTS_COUNT,
+            date_field='created',
+        )
+        page_tags(request, post_page_tags(post))
         context = {
             'post': post,
             'form': form,
@@ -59,6 +102,22 @@ def post_detail(request, post_id):
         return render(request, 'posts/post_detail.html', context)
 
 
+def post_comments(request, post_id):
+    """Следующая страница комментариев фрагментом без обвязки сайта."""
+    post = get_object_or_404(Post.objects.only('pk'), pk=post_id)
+    comments = cursor_paginator_create(
+        post.comments.select_related('author'),
+        request.GET.get('cursor'),
+        per_page=COMMENTS_COUNT,
+        date_field='created',
+    )
+    context = {
+        'post_id': post_id,
+        'comments': comments,
+    }
+    return render(request, 'posts/includes/comments.html', context)
+
+
 @login_required
 def post_create(request):
     form = PostForm(
@@ -69,7 +128,8 @@ def post_create(request):
     if form.is_valid():
         post = form.save(commit=False)
         post.author = user
-        post.save()
+        with transaction.atomic():
+            post.save()
         return redirect('posts:profile', user.username)
     else:
         context = {'form': form}
@@ -90,7 +150,8 @@ def post_edit(request, post_id):
     )
 
     if form.is_valid():
-        form.save()
+        with transaction.atomic():
+            form.save()
         post.moderated = False
         return redirect('posts:post_detail', post.id)
 
@@ -114,32 +175,37 @@ def add_comment(request, post_id):
 
 
 @login_required
+@conditional_page(conditional.follow_tags)
 def follow_index(request):
     user = request.user
-    post_list = Post.objects.filter(author__following__user__id=user.id)
+    page_obj, pulled, stats = follow_page(user, request)
+    logger.info('follow feed for user %s: %s', user.pk, stats)
     context = {
-        'page_obj': paginator_create(post_list, request.GET.get('page')),
+        'page_obj': page_obj,
+        **feed_cache(request, *follow_feed_tags(user.pk, pulled)),
     }
-    return render(request, 'posts/follow.html', context)
+    response = render(request, 'posts/follow.html', context)
+    response['Server-Timing'] = (
+        f'feed-plan;dur={stats["plan_ms"]:.2f}, '
+        f'feed-merge;dur={stats["merge_ms"]:.2f};'
+        f'desc="{stats["strategy"]}, '
+        f'pulled {stats["pulled"]} of {stats["following"]}, '
+        f'threshold {stats["threshold"]}"'
+    )
+    return response
 
 
 @login_required
 def profile_follow(request, username):
     user = request.user
     author = get_object_or_404(User, username=username)
-    if (
-        user != author
-        and not
-        Follow.objects.filter(user=user, author=author).exists()
-    ):
-        Follow.objects.create(user=user, author=author)
+    if user != author:
+        follow_author(user, author)
     return redirect('posts:profile', author.username)
 
 
 @login_required
 def profile_unfollow(request, username):
-    user = request.user
     author = get_object_or_404(User, username=username)
-    if Follow.objects.filter(user=user, author=author).exists():
-        Follow.objects.get(user=user, author=author).delete()
+    unfollow_author(request.user, author)
     return redirect('posts:profile', author.username)
@@ -0,0 +1,64 @@
+"""Пул процессов для обработки картинок вне запросов.
+
+Очередь пула ограничена IMAGE_QUEUE_SIZE задачами: когда она полна,
+submit() сразу возвращает False, а не копит работу в памяти воркера.
+При IMAGE_WORKERS = 0 пула нет и submit() всегда возвращает False: так
+тесты не запускают процессы, которые работали бы с базой из настроек, а
+не с тестовой.
+"""
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import django
+from django.conf import settings
+
+_pool = None
+_slots = threading.BoundedSemaphore(settings.IMAGE_QUEUE_SIZE)
+
+
+def executor():
+    """Пул, общий для воркера; создаётся при первой задаче.
+
+    Процессы запускаются заново, а не форком, чтобы не унаследовать
+    соединения с базой посреди запроса. Задачи живут в модулях, которые
+    импортируют модели, поэтому Django настраивается ещё до распаковки
+    первой задачи. None, если обработка картинок выключена.
+    """
+    global _pool
+    if not settings.IMAGE_WORKERS:
+        return None
+    if _pool is None:
+        _pool = ProcessPoolExecutor(
+            max_workers=settings.IMAGE_WORKERS,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=django.setup,
+        )
+    return _pool
+
+
+def submit(fn, *args, done):
+    """Отдаёт fn(*args) пулу; done(future) вызывается по завершении.
+
+    Возвращает False, если очередь пула заполнена или пула нет.
+    """
+    global _pool
+    if executor() is None or not _slots.acquire(blocking=False):
+        return False
+    try:
+        try:
+            future = executor().submit(fn, *args)
+        except BrokenProcessPool:
+            _pool = None
+            future = executor().submit(fn, *args)
+    except Exception:
+        _slots.release()
+        raise
+
+    def finished(future):
+        _slots.release()
+        done(future)
+
+    future.add_done_callback(finished)
+    return True
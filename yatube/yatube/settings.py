@@ -1,5 +1,5 @@
 import os
-from decouple import config
+from decouple import Csv, config
 
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
@@ -112,12 +112,36 @@ MEDIA_URL = '/media/'
 
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Общий для всех воркеров кеш: CACHE_BACKEND=core.cache_backends.sqlite.SQLiteCache
+# и путь к файлу в CACHE_LOCATION.
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'BACKEND': config(
+            'CACHE_BACKEND',
+            default='django.core.cache.backends.locmem.LocMemCache',
+        ),
+        'LOCATION': config('CACHE_LOCATION', default=''),
+        'OPTIONS': {
+            'MAX_ENTRIES': config('CACHE_MAX_ENTRIES', default=10_000, cast=int),
+        },
     }
 }
 
+# Число процессов, которые обрабатывают картинки постов вне запросов, и
+# сколько задач может ждать их в очереди. При IMAGE_WORKERS = 0 картинки
+# не обрабатываются: так запускаются тесты.
+IMAGE_WORKERS = config('IMAGE_WORKERS', default=2, cast=int)
+IMAGE_QUEUE_SIZE = config('IMAGE_QUEUE_SIZE', default=100, cast=int)
+
+# Загруженные картинки уменьшаются до этого размера по большей стороне.
+IMAGE_MAX_SIDE = config('IMAGE_MAX_SIDE', default=2048, cast=int)
+
+# Ширины миниатюр для srcset и форматы, в которых рисуется каждая.
+# Последний формат — запасной для браузеров, не знающих остальных.
+# Форматы приводятся к верхнему регистру, как их называет Pillow.
+THUMBNAIL_WIDTHS = config('THUMBNAIL_WIDTHS', default='480,960,1440', cast=Csv(int))
+THUMBNAIL_FORMATS = config('THUMBNAIL_FORMATS', default='WEBP,JPEG', cast=Csv(str.upper))
+
 INTERNAL_IPS = [
     '127.0.0.1',
 ]